@@ -0,0 +1,144 @@
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from logging_config import logger
+from metrics import metrics
+from llm.router import router
+from agent.doc_detecter import LABELS
+from agent.extract_agent import DOC_TYPES, is_missing, missing_required
+
+load_dotenv()
+
+# 模型级联：配置 SMALL_TEXT_MODEL（或各后端的 LLM_BACKEND_<名称>_SMALL_TEXT_MODEL）后，
+# 分类与提取先用小模型，结果不可靠时再升级到 TEXT_MODEL
+SMALL_KIND = "small_text"
+# 规则分类置信度达到该值且与小模型结论不一致时视为与关键词证据矛盾
+CASCADE_EVIDENCE_CONFIDENCE = float(os.getenv("CASCADE_EVIDENCE_CONFIDENCE", "0.3"))
+
+# 编号类字段应能在原文中找到，找不到时视为小模型编造
+ID_FIELDS = {
+    "专利": ("专利号",),
+    "论文": ("DOI",),
+    "标准": ("标准编号",),
+    "软著": ("证书号", "登记号"),
+}
+
+for _stage in ("classify", "extract", "combined"):
+    metrics.register_ratio(f"cascade.{_stage}.escalation_rate", f"cascade.{_stage}.escalated", f"cascade.{_stage}.total")
+
+_NON_ALNUM_RE = re.compile(r"[\W_]+")
+
+
+def enabled() -> bool:
+    return router.serves(SMALL_KIND)
+
+
+def _compact(value: Any) -> str:
+    return _NON_ALNUM_RE.sub("", str(value)).upper()
+
+
+def answer_label(raw: str) -> Optional[str]:
+    """</think> 之后的回答中出现的类型标签，没有时返回 None"""
+    answer = raw.split("</think>")[-1]
+    return next((label for label in LABELS if label in answer), None)
+
+
+def classification_problem(label: Optional[str], rule_guess: str, confidence: float) -> Optional[str]:
+    """小模型分类结果需要升级的原因，可靠时返回 None"""
+    if label is None:
+        return "format"
+    if label == "其他":
+        # “其他”会进入 OCR 兜底流程，代价远高于一次大模型分类
+        return "other"
+    if rule_guess in DOC_TYPES and confidence >= CASCADE_EVIDENCE_CONFIDENCE and rule_guess != label:
+        return "evidence"
+    return None
+
+
+def _unsupported_ids(doc_type: str, info: Dict[str, Any], text: str) -> list:
+    compact_text = None
+    unsupported = []
+    for field in ID_FIELDS.get(doc_type, ()):
+        value = info.get(field)
+        if is_missing(value):
+            continue
+        compact_text = compact_text if compact_text is not None else _compact(text)
+        if _compact(value) not in compact_text:
+            unsupported.append(field)
+    return unsupported
+
+
+def extraction_problem(doc_type: str, info: Dict[str, Any], text: str) -> Optional[str]:
+    """小模型提取结果需要升级的原因，可靠时返回 None"""
+    if "error" in info:
+        return "schema"
+    if missing_required(doc_type, info):
+        return "required"
+    if _unsupported_ids(doc_type, info, text):
+        return "evidence"
+    return None
+
+
+def _escalate(stage: str, reason: str, detail: str = ""):
+    metrics.incr(f"cascade.{stage}.escalated")
+    metrics.incr(f"cascade.{stage}.reason.{reason}")
+    logger.info(f"小模型{stage}结果不可靠（{reason}{detail}），升级到大模型")
+
+
+def _reliable_fields(doc_type: str, info: Dict[str, Any], text: str) -> Dict[str, Any]:
+    unsupported = set(_unsupported_ids(doc_type, info, text))
+    return {k: v for k, v in info.items() if k != "error" and k not in unsupported and not is_missing(v)}
+
+
+async def classify(call: Callable[[str], Awaitable[str]], rule_guess: str, confidence: float) -> str:
+    """call(kind) 返回模型原始输出；先用小模型，不可靠时用大模型重新分类"""
+    if not enabled():
+        return await call("text")
+    metrics.incr("cascade.classify.total")
+    raw = await call(SMALL_KIND)
+    reason = classification_problem(answer_label(raw), rule_guess, confidence)
+    if reason is None:
+        return raw
+    _escalate("classify", reason, f"，小模型: {answer_label(raw)}，规则: {rule_guess}")
+    return await call("text")
+
+
+async def extract(call: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]], doc_type: str, text: str,
+                  known: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    call(kind, known) 返回提取结果；先用小模型，不可靠时保留可信字段，
+    由大模型只补充缺失、无效或原文中找不到的字段。
+    """
+    if not enabled():
+        return await call("text", known)
+    metrics.incr("cascade.extract.total")
+    info = await call(SMALL_KIND, known)
+    reason = extraction_problem(doc_type, info, text)
+    if reason is None:
+        return info
+    _escalate("extract", reason)
+    return await call("text", {**_reliable_fields(doc_type, info, text), **known})
+
+
+async def classify_and_extract(call: Callable[[str], Awaitable[Optional[Tuple[str, Dict[str, Any]]]]],
+                               rule_guess: str, confidence: float,
+                               text: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """合并模式的级联：类型或字段任一不可靠时整体用大模型重做"""
+    if not enabled():
+        return await call("text")
+    metrics.incr("cascade.combined.total")
+    combined = await call(SMALL_KIND)
+    if combined is None:
+        reason = "schema"
+    else:
+        doc_type, fields = combined
+        reason = classification_problem(doc_type, rule_guess, confidence)
+        if reason is None and doc_type in DOC_TYPES:
+            reason = extraction_problem(doc_type, fields, text)
+    if reason is None:
+        return combined
+    _escalate("combined", reason)
+    return await call("text")
@@ -1,29 +1,57 @@
 import os
-import asyncio
-import itertools
-import aiohttp
 import logging
 from dotenv import load_dotenv
 
+from metrics import metrics
+from llm.client import chat_completion
+
 # 加载环境变量
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# 定义全局信号量，限制并发数（根据机器性能和模型QPS设置，比如3）
-semaphore = asyncio.Semaphore(3)
+# 获取配置
+TEXT_MODEL = os.getenv("TEXT_MODEL")
 
-API_KEYS = [k.strip() for k in os.getenv("API_KEY", "").split(",") if k.strip()]
-api_key_cycle = itertools.cycle(API_KEYS)
+# 分类调用使用流式输出，</think> 之后出现类型标签或回复只有一个标签时即停止读取
+CLASSIFY_STREAM = os.getenv("CLASSIFY_STREAM", "true").lower() in ("1", "true", "yes")
+# 分类调用的输出上限，推理模型需留出思考部分的余量；达到上限仍未给出类型时去掉上限重试一次；0 表示不限制
+CLASSIFY_MAX_TOKENS = int(os.getenv("CLASSIFY_MAX_TOKENS", "256"))
 
-def get_next_api_key():
-    return next(api_key_cycle)
+LABELS = ("专利", "论文", "标准", "软著", "其他")
+
+
+LABEL_PUNCTUATION = " \t\r\n\"'“”‘’「」『』【】[]()（）*`。.，,：:"
+
+
+def label_ready(content: str) -> bool:
+    """
+    流式读取时判断能否停止：</think> 之后已出现类型标签，或整个回复就是一个标签。
+    有的推理模型省略开头的 <think>、只输出 </think>，思考部分里提到的类型不能当作答案。
+    """
+    if "</think>" in content:
+        answer = content.split("</think>")[-1]
+        return any(label in answer for label in LABELS)
+    return content.strip(LABEL_PUNCTUATION) in LABELS
+
+
+def label_answered(content: str) -> bool:
+    """完整回复中推理部分之后是否给出了类型标签"""
+    head = content.lstrip()
+    if head.startswith("<") and "</think>" not in head:
+        return False
+    answer = head.split("</think>")[-1]
+    return any(label in answer for label in LABELS)
+
+
+async def _classify_call(payload: dict, kind: str):
+    return await chat_completion(payload, timeout=300, kind=kind,
+                                 stop_when=label_ready if CLASSIFY_STREAM else None,
+                                 cache_if=lambda d: label_answered(d["choices"][0]["message"]["content"]))
 
-# 获取配置
-API_BASE_URL = os.getenv("API_BASE_URL")
-TEXT_MODEL = os.getenv("TEXT_MODEL")
 
-async def detect_doc_type(text: str) -> str:
+async def detect_doc_type(text: str, kind: str = "text") -> str:
+    """kind 为 small_text 时使用级联中的小模型"""
     if not text or not text.strip():
         logger.warning("输入文本为空，跳过文档类型检测")
         return "其他"
@@ -39,42 +67,27 @@ async def detect_doc_type(text: str) -> str:
     logger.info("开始检测文档类型")
     logger.debug(f"发送给大模型的提示: {prompt.strip()}")
 
-    url = API_BASE_URL
     payload = {
         "model": TEXT_MODEL,
         "messages": [
             {"role": "user", "content": [{"type": "text", "text": prompt}]}
         ],
     }
+    if CLASSIFY_MAX_TOKENS > 0:
+        payload["max_tokens"] = CLASSIFY_MAX_TOKENS
 
-    async with semaphore:
-        async with aiohttp.ClientSession() as session:
-            for attempt in range(3):  # 最多重试3次
-                API_KEY = get_next_api_key()  # 每次尝试都取一个Key（避免一个key被限流）
-                headers = {
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json"
-                }
-                try:
-                    async with session.post(url, json=payload, headers=headers, timeout=300) as resp:
-                        data = await resp.json()
-
-                        # --- 限流检测 ---
-                        if "rate limit" in str(data).lower() or "tpm" in str(data).lower():
-                            logger.warning(f"触发限流（第{attempt + 1}次），切换下一个API_KEY重试")
-                            await asyncio.sleep(2 * (attempt + 1))
-                            continue
-
-                        # --- 正常响应 ---
-                        if "choices" in data:
-                            result = data["choices"][0]["message"]["content"].strip()
-                            logger.info(f"大模型返回结果: {result}")
-                            return result
-                        else:
-                            logger.error(f"调用模型失败（第{attempt + 1}次）: {data}")
-                except Exception as e:
-                    logger.warning(f"调用模型异常（第{attempt + 1}次）: {e}")
-                    await asyncio.sleep(2 * (attempt + 1))
+    # 并发控制、Key轮换与重试由共享客户端统一处理
+    data = await _classify_call(payload, kind)
+    if data is not None and "max_tokens" in payload and not label_answered(data["choices"][0]["message"]["content"]):
+        # 思考部分超出输出上限、没有给出类型时不能当作“其他”（会进入代价最高的 OCR 流程），去掉上限重试
+        metrics.incr("classify.max_tokens_retry")
+        logger.warning(f"分类输出达到上限 {CLASSIFY_MAX_TOKENS} tokens 仍未给出类型，去掉上限重试")
+        payload = {k: v for k, v in payload.items() if k != "max_tokens"}
+        data = await _classify_call(payload, kind)
+    if data is not None:
+        result = data["choices"][0]["message"]["content"].strip()
+        logger.info(f"大模型返回结果: {result}")
+        return result
 
     logger.error("多次重试后仍失败，返回默认类型: 其他")
     return "其他"
@@ -2,108 +2,158 @@ import os
 import re
 import json
 import asyncio
-import aiohttp
-import itertools
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 from logging_config import logger
+from metrics import metrics
+from llm.client import chat_completion
+from agent.schemas import is_missing, json_schema, validate_fields
 
 # ===============================
 # 环境变量与全局配置
 # ===============================
 load_dotenv()
 
-API_BASE_URL = os.getenv("API_BASE_URL")
 TEXT_MODEL = os.getenv("TEXT_MODEL")
 
-API_KEYS = [k.strip() for k in os.getenv("API_KEY", "").split(",") if k.strip()]
-api_key_cycle = itertools.cycle(API_KEYS)
+# 提示词版本，修改分类或提取提示词后需递增，使结果缓存失效
+PROMPT_VERSION = "3"
 
-# 控制并发数（建议3-5，根据服务器和模型性能调整）
-semaphore = asyncio.Semaphore(3)
+DOC_TYPES = ("专利", "论文", "标准", "软著")
 
-def get_next_api_key():
-    return next(api_key_cycle)
+# 各文档类型需要提取的字段及格式说明
+FIELD_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "专利": {
+        "专利号": "",
+        "专利名称": "",
+        "申请日期": "YYYY-MM-DD",
+        "授权日期": "YYYY-MM-DD 或 N/A",
+        "发明人": "以逗号分隔",
+        "受让人": "公司或机构名称",
+    },
+    "论文": {
+        "标题": "",
+        "作者": "张三; 李四",
+        "期刊": "",
+        "year": 2024,
+        "DOI": "",
+        "received_date": "YYYY-MM-DD",
+        "accepted_date": "YYYY-MM-DD",
+        "published_date": "YYYY-MM-DD",
+        "project_number": "",
+        "institution": "",
+    },
+    "标准": {
+        "标准名称": "",
+        "标准形式": "国标/地标/团标",
+        "标准编号": "",
+        "起草单位": "",
+        "起草人": "",
+        "发布单位": "",
+        "发布时间": "YYYY-MM-DD",
+        "实施时间": "YYYY-MM-DD",
+    },
+    "软著": {
+        "证书号": "",
+        "软件名称": "",
+        "著作权人": "",
+        "登记号": "",
+        "授权时间": "YYYY-MM-DD",
+    },
+}
+
+# 必填字段：窗口化文本提取后这些字段缺失时，回退到全文重新提取
+REQUIRED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "专利": ("专利号", "专利名称", "申请日期"),
+    "论文": ("标题", "作者", "期刊"),
+    "标准": ("标准名称", "标准编号", "发布时间"),
+    "软著": ("软件名称", "著作权人", "登记号"),
+}
+
+# 分块提取结果的合并方式：默认取文档中最靠前的有效值；join 字段合并各块的不同取值
+JOIN_FIELDS = {"作者", "发明人", "project_number", "institution", "起草单位", "起草人"}
+
+PROMPT_HEADS = {
+    "专利": "请从以下专利文件《{filename}》的文本中提取信息：",
+    "论文": "请从以下论文文件《{filename}》中提取信息：",
+    "标准": "请从以下标准文件《{filename}》中提取信息：",
+    "软著": "请从以下软件著作权登记文件《{filename}》中提取信息：",
+}
+
+
+def render_schema(schema: Dict[str, Any]) -> str:
+    return json.dumps(schema, ensure_ascii=False, indent=2)
+
+
+def _is_json_object(parsed: Any) -> bool:
+    return isinstance(parsed, dict) and "error" not in parsed
+
+
+def _json_reply(data: Dict[str, Any]) -> bool:
+    """响应能否解析为 JSON 对象，不能解析的响应不写入缓存"""
+    return _is_json_object(_parse_json_from_response(data["choices"][0]["message"]["content"].strip()))
+
+
+def missing_required(doc_type: str, info: Dict[str, Any]) -> bool:
+    return "error" in info or any(is_missing(info.get(k)) for k in REQUIRED_FIELDS.get(doc_type, ()))
+
+
+def merge_fields(doc_type: str, extracted: Dict[str, Any], known: Dict[str, Any]) -> Dict[str, Any]:
+    """合并大模型结果与规则提取的字段（规则优先），按字段定义顺序排列"""
+    merged = {**extracted, **known}
+    ordered = {k: merged.pop(k) for k in FIELD_SCHEMAS[doc_type] if k in merged}
+    ordered.update(merged)
+    return ordered
 
 
 # ===============================
 # 核心函数：extract_info
 # ===============================
-async def extract_info(text: str, doc_type: str, filename: str) -> Dict[str, Any]:
+async def extract_info(text: str, doc_type: str, filename: str,
+                       known: Optional[Dict[str, Any]] = None, kind: str = "text") -> Dict[str, Any]:
+    """
+    提取文档字段。known 为已由规则提取的字段，只向大模型请求其余字段；
+    全部字段均已知时不调用大模型。kind 为 small_text 时使用级联中的小模型。
+    """
     logger.info(f"开始提取信息，文档类型: {doc_type}, 文件名: {filename}")
 
     # ---------- 生成 prompt ----------
-    if doc_type == "专利":
-        prompt = f"""
-        请从以下专利文件《{filename}》的文本中提取信息：
-        {text}
+    if doc_type not in FIELD_SCHEMAS:
+        raise ValueError(f"未知的文档类型: {doc_type}")
 
-        返回严格 JSON 格式，包含以下字段：
-        {{
-          "专利号": "",
-          "专利名称": "",
-          "申请日期": "YYYY-MM-DD",
-          "授权日期": "YYYY-MM-DD 或 N/A",
-          "发明人": "以逗号分隔",
-          "受让人": "公司或机构名称"
-        }}
-        """
-    elif doc_type == "论文":
-        prompt = f"""
-        请从以下论文文件《{filename}》中提取信息：
+    known = known or {}
+    missing = {k: v for k, v in FIELD_SCHEMAS[doc_type].items() if k not in known}
+    if not missing:
+        logger.info(f"全部字段已由规则提取，跳过大模型调用: {filename}")
+        metrics.incr("field_extractor.llm_skipped")
+        return merge_fields(doc_type, {}, known)
+    if known:
+        logger.info(f"规则已提取字段 {list(known)}，仅向大模型请求其余 {len(missing)} 个字段")
+
+    prompt = f"""
+        {PROMPT_HEADS[doc_type].format(filename=filename)}
         {text}
 
-        返回严格 JSON 格式，包含：
-        {{
-          "标题": "",
-          "作者": "张三; 李四",
-          "期刊": "",
-          "year": 2024,
-          "DOI": "",
-          "received_date": "YYYY-MM-DD",
-          "accepted_date": "YYYY-MM-DD",
-          "published_date": "YYYY-MM-DD",
-          "project_number": "",
-          "institution": ""
-        }}
+        返回严格 JSON 格式，包含以下字段：
+        {render_schema(missing)}
         没有的字段填 "N/A"。
         """
-    elif doc_type == "标准":
-        prompt = f"""
-        请从以下标准文件《{filename}》中提取信息：
-        {text}
 
-        返回严格 JSON 格式，包含：
-        {{
-          "标准名称": "",
-          "标准形式": "国标/地标/团标",
-          "标准编号": "",
-          "起草单位": "",
-          "起草人": "",
-          "发布单位": "",
-          "发布时间": "YYYY-MM-DD",
-          "实施时间": "YYYY-MM-DD"
-        }}
-        """
-    elif doc_type == "软著":
-        prompt = f"""
-        请从以下软件著作权登记文件《{filename}》中提取信息：
-        {text}
+    # ---------- 并发控制 + 限流 + 重试（由共享客户端处理） ----------
+    data = await chat_completion(_payload(prompt, doc_type, list(missing)), timeout=400, kind=kind,
+                                 cache_ignore=(filename,), cache_if=_json_reply)
+    if data is not None:
+        content = data["choices"][0]["message"]["content"].strip()
+        fields = await _validate_and_repair(text, doc_type, filename, _parse_json_from_response(content),
+                                            list(missing), kind)
+        return merge_fields(doc_type, fields, known)
+
+    logger.error("多次重试后仍失败，返回空结果")
+    return merge_fields(doc_type, {"error": "信息提取失败"}, known)
 
-        返回严格 JSON 格式，包含：
-        {{
-          "证书号": "",
-          "软件名称": "",
-          "著作权人": "",
-          "登记号": "",
-          "授权时间": "YYYY-MM-DD"
-        }}
-        """
-    else:
-        raise ValueError(f"未知的文档类型: {doc_type}")
 
-    # ---------- 构造请求 ----------
-    url = API_BASE_URL
+def _payload(prompt: str, doc_type: Optional[str] = None, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """构造提取请求；给出字段时附带 JSON Schema，由路由按后端能力决定是否启用约束解码"""
     payload = {
         "model": TEXT_MODEL,
         "messages": [
@@ -113,42 +163,140 @@ async def extract_info(text: str, doc_type: str, filename: str) -> Dict[str, Any
             }
         ],
     }
+    if doc_type and fields:
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "extraction", "schema": json_schema(doc_type, fields)},
+        }
+    return payload
 
-    # ---------- 并发控制 + 限流 + 重试 ----------
-    async with semaphore:
-        async with aiohttp.ClientSession() as session:
-            for attempt in range(3):
-                API_KEY = get_next_api_key()
-                headers = {
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json"
-                }
-
-                try:
-                    async with session.post(url, json=payload, headers=headers, timeout=400) as resp:
-                        data = await resp.json()
-                        logger.debug(f"大模型响应: {data}")
-
-                        # --- 限流检测 ---
-                        if "rate limit" in str(data).lower() or "tpm" in str(data).lower():
-                            logger.warning(f"触发限流（第{attempt+1}次），切换下一个API_KEY重试")
-                            await asyncio.sleep(2 * (attempt + 1))
-                            continue
-
-                        if "choices" not in data:
-                            logger.error(f"调用失败（第{attempt+1}次）: {data}")
-                            await asyncio.sleep(2 * (attempt + 1))
-                            continue
-
-                        content = data["choices"][0]["message"]["content"].strip()
-                        return _parse_json_from_response(content)
-
-                except Exception as e:
-                    logger.warning(f"调用模型异常（第{attempt+1}次）: {e}")
-                    await asyncio.sleep(2 * (attempt + 1))
 
-    logger.error("多次重试后仍失败，返回空结果")
-    return {"error": "信息提取失败"}
+async def _validate_and_repair(text: str, doc_type: str, filename: str, parsed: Any, fields: List[str],
+                               kind: str) -> Dict[str, Any]:
+    """
+    按 schema 校验字段，不合格的字段单独发起一次修复调用，只请求这些字段；
+    修复后仍不合格的字段置为 N/A；只有原始回复与修复回复都不是 JSON 对象时才返回 error。
+    """
+    valid, invalid = validate_fields(doc_type, parsed, fields)
+    metrics.incr("schema.validated")
+    if not invalid:
+        return valid
+
+    metrics.incr("schema.invalid_fields", len(invalid))
+    metrics.incr("schema.repair_calls")
+    logger.warning(f"字段校验失败，发起修复调用: {filename} {list(invalid)}")
+    problems = "\n".join(f"- {field}: {value if value is not None else '无'}（{reason}）"
+                         for field, (value, reason) in invalid.items())
+    hints = {field: FIELD_SCHEMAS[doc_type].get(field, "") for field in invalid}
+    prompt = f"""
+        {PROMPT_HEADS[doc_type].format(filename=filename)}
+        {text}
+
+        之前提取的以下字段不符合格式要求：
+        {problems}
+        请只重新提取这些字段，返回严格 JSON 格式：
+        {render_schema(hints)}
+        没有的字段填 "N/A"。
+        """
+    data = await chat_completion(_payload(prompt, doc_type, list(invalid)), timeout=400, kind=kind,
+                                 cache_ignore=(filename,), cache_if=_json_reply)
+    repaired, still_invalid, repair_parsed = {}, invalid, None
+    if data is not None:
+        content = data["choices"][0]["message"]["content"].strip()
+        repair_parsed = _parse_json_from_response(content)
+        repaired, still_invalid = validate_fields(doc_type, repair_parsed, list(invalid))
+    metrics.incr("schema.repaired_fields", len(repaired))
+
+    if not _is_json_object(parsed) and not _is_json_object(repair_parsed):
+        return {"error": "解析失败"}
+    return {**valid, **repaired, **{field: "N/A" for field in still_invalid}}
+
+
+# ===============================
+# 长文档分块并行提取
+# ===============================
+def reduce_fields(doc_type: str, partials: List[Dict[str, Any]], known: Dict[str, Any]) -> Dict[str, Any]:
+    """按字段优先级合并各块的提取结果，partials 需按文档顺序排列"""
+    reduced: Dict[str, Any] = {}
+    for field in FIELD_SCHEMAS[doc_type]:
+        values = [part[field] for part in partials if not is_missing(part.get(field))]
+        if not values:
+            continue
+        if field in JOIN_FIELDS:
+            seen = []
+            for value in values:
+                if str(value) not in seen:
+                    seen.append(str(value))
+            reduced[field] = "; ".join(seen)
+        else:
+            reduced[field] = values[0]
+    if not reduced and all("error" in part for part in partials):
+        reduced["error"] = "信息提取失败"
+    return merge_fields(doc_type, reduced, known)
+
+
+async def extract_info_chunked(chunks: List[str], doc_type: str, filename: str,
+                               known: Optional[Dict[str, Any]] = None, kind: str = "text") -> Dict[str, Any]:
+    """
+    各文本块并发提取候选字段后合并，耗时取决于最慢的一块而不是全文长度；
+    并发度由共享客户端的并发上限约束。
+    """
+    known = known or {}
+    logger.info(f"分块并行提取: {filename}, 共 {len(chunks)} 块")
+    metrics.incr("map_reduce.documents")
+    metrics.incr("map_reduce.chunks", len(chunks))
+    partials = await asyncio.gather(*(extract_info(chunk, doc_type, filename, known, kind) for chunk in chunks))
+    return reduce_fields(doc_type, list(partials), known)
+
+
+# ===============================
+# 合并模式：一次调用完成分类与提取
+# ===============================
+async def classify_and_extract(text: str, filename: str,
+                               kind: str = "text") -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    单次调用同时返回文档类型与对应字段，返回 (类型, 字段)；
+    类型不属于 DOC_TYPES 时返回 ("其他", {})，调用或解析失败时返回 None 以便回退到分步模式。
+    """
+    logger.info(f"开始分类并提取信息（合并模式），文件名: {filename}")
+    schemas = "\n".join(f"{doc_type}：\n{render_schema(schema)}" for doc_type, schema in FIELD_SCHEMAS.items())
+    prompt = f"""
+        请判断以下文件《{filename}》是专利、论文、标准、软著还是其他，并按对应类型提取信息：
+        {text}
+
+        返回严格 JSON 格式：{{"类型": "专利/论文/标准/软著/其他", "字段": {{...}}}}
+        其中“字段”按类型包含以下内容：
+        {schemas}
+        类型为“其他”时“字段”返回 {{}}。没有的字段填 "N/A"。
+        """
+
+    payload = _payload(prompt)
+    payload["response_format"] = {"type": "json_object"}
+
+    data = await chat_completion(payload, timeout=400, kind=kind, cache_ignore=(filename,),
+                                 cache_if=lambda d: _combined_fields(d) is not None)
+    if data is None:
+        logger.error("合并模式调用失败")
+        return None
+
+    parsed = _combined_fields(data)
+    if parsed is None:
+        logger.error(f"合并模式返回格式不正确: {data['choices'][0]['message']['content'][:200]}...")
+        return None
+    fields = parsed["字段"]
+
+    doc_type = str(parsed.get("类型", ""))
+    for known in DOC_TYPES:
+        if known in doc_type:
+            return known, await _validate_and_repair(text, known, filename, fields, list(FIELD_SCHEMAS[known]), kind)
+    return "其他", {}
+
+
+def _combined_fields(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """解析合并模式的响应，“字段”不是 JSON 对象时返回 None"""
+    content = data["choices"][0]["message"]["content"].split("</think>")[-1].strip()
+    parsed = _parse_json_from_response(content)
+    return parsed if isinstance(parsed, dict) and isinstance(parsed.get("字段"), dict) else None
 
 
 # ===============================
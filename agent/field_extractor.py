@@ -0,0 +1,127 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agent.patterns import (
+    BARE_PATENT_NO, DOI, DOI_PREFIX, GB_STANDARD_NO, GROUP_STANDARD_NO, LOCAL_STANDARD_NO, NO_ALNUM_BEFORE,
+    PATENT_NO, SOFTWARE_REG_NO,
+)
+
+# ===============================
+# 日期识别与归一化（YYYY-MM-DD）
+# ===============================
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_MONTH = r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)"
+
+DATE = (
+    r"(?:(?P<y1>\d{4})\s*[年./-]\s*(?P<m1>\d{1,2})\s*[月./-]\s*(?P<d1>\d{1,2})\s*日?"
+    rf"|(?P<d2>\d{{1,2}})\s*(?P<m2>{_MONTH})\.?\s*,?\s*(?P<y2>\d{{4}})"
+    rf"|(?P<m3>{_MONTH})\.?\s*(?P<d3>\d{{1,2}})\s*,?\s*(?P<y3>\d{{4}}))"
+)
+
+
+def normalize_date(match: re.Match) -> Optional[str]:
+    groups = match.groupdict()
+    for i in ("1", "2", "3"):
+        if groups.get(f"y{i}"):
+            year, month, day = groups[f"y{i}"], groups[f"m{i}"], groups[f"d{i}"]
+            month = int(month) if month.isdigit() else _MONTHS[month[:3].lower()]
+            day = int(day)
+            if 1 <= month <= 12 and 1 <= day <= 31:
+                return f"{int(year):04d}-{month:02d}-{day:02d}"
+    return None
+
+
+def _anchored_date(anchor: str) -> re.Pattern:
+    """锚点词后紧跟的日期，如“申请日：2019年1月2日”、“Received: 4 December 2023”"""
+    return re.compile(rf"(?:{anchor})\s*[:：]?\s*{DATE}", re.I)
+
+
+def _date_then(anchor: str) -> re.Pattern:
+    """日期在前、锚点词在后，如“2016-01-01 实施”"""
+    return re.compile(rf"{DATE}\s*(?:{anchor})", re.I)
+
+
+# ===============================
+# 字段规则：字段名 -> [(正则, 取值函数)]
+# ===============================
+Rule = Tuple[re.Pattern, Callable[[re.Match], Optional[str]]]
+
+
+def _group(name: str = "value") -> Callable[[re.Match], Optional[str]]:
+    return lambda m: re.sub(r"\s+", "", m.group(name))
+
+
+# 编号类正则见 agent.patterns
+_PATENT_NO = rf"(?P<value>{PATENT_NO}|{BARE_PATENT_NO})"
+_STANDARD_NO = rf"(?P<value>{NO_ALNUM_BEFORE}(?:{GB_STANDARD_NO}|{LOCAL_STANDARD_NO})|{GROUP_STANDARD_NO})"
+
+
+def _normalize_standard_no(value: str) -> str:
+    """统一斜杠与连接号，如“GB/T 7714—2015” -> “GB/T 7714-2015”"""
+    value = re.sub(r"\s*/\s*", "/", value)
+    return re.sub(r"\s*[-—－]\s*", "-", value)
+
+
+FIELD_RULES: Dict[str, Dict[str, List[Rule]]] = {
+    "专利": {
+        "专利号": [
+            (re.compile(r"专利号\s*[:：]?\s*" + _PATENT_NO), _group()),
+            (re.compile(NO_ALNUM_BEFORE + _PATENT_NO), _group()),
+        ],
+        "申请日期": [(_anchored_date(r"专利申请日|申请日期|申请日"), normalize_date)],
+        "授权日期": [(_anchored_date(r"授权公告日|授权日期|授权日"), normalize_date)],
+    },
+    "论文": {
+        "DOI": [(re.compile(rf"{NO_ALNUM_BEFORE}{DOI_PREFIX}(?P<value>{DOI})", re.I),
+                 lambda m: m.group("value").rstrip(".;,"))],
+        "received_date": [(_anchored_date(r"Received|收稿日期"), normalize_date)],
+        "accepted_date": [(_anchored_date(r"Accepted|录用日期|接受日期"), normalize_date)],
+        "published_date": [(_anchored_date(r"Published online|Published|出版日期|网络出版日期"), normalize_date)],
+    },
+    "标准": {
+        "标准编号": [(re.compile(_STANDARD_NO), lambda m: _normalize_standard_no(m.group("value")))],
+        "发布时间": [(_date_then(r"发布"), normalize_date)],
+        "实施时间": [(_date_then(r"实施"), normalize_date)],
+    },
+    "软著": {
+        "证书号": [(re.compile(r"(?P<value>软著登字\s*第\s*\d+\s*号)"), _group())],
+        "登记号": [(re.compile(rf"{NO_ALNUM_BEFORE}(?P<value>{SOFTWARE_REG_NO})"), _group())],
+        "授权时间": [(_anchored_date(r"登记日期|发证日期"), normalize_date)],
+    },
+}
+
+
+def _standard_form(number: str) -> Optional[str]:
+    if number.startswith("GB"):
+        return "国标"
+    if number.startswith("DB"):
+        return "地标"
+    if number.startswith("T/"):
+        return "团标"
+    return None
+
+
+def extract_fields(text: str, doc_type: str) -> Dict[str, Any]:
+    """从文本层直接提取格式固定的字段，只返回找到的字段"""
+    found: Dict[str, Any] = {}
+    if not text:
+        return found
+    for field, rules in FIELD_RULES.get(doc_type, {}).items():
+        for pattern, getter in rules:
+            match = pattern.search(text)
+            value = getter(match) if match else None
+            if value:
+                found[field] = value
+                break
+
+    # 可由已提取字段推导的字段
+    if doc_type == "标准" and "标准编号" in found:
+        form = _standard_form(found["标准编号"])
+        if form:
+            found["标准形式"] = form
+    if doc_type == "论文" and "published_date" in found:
+        found["year"] = int(found["published_date"][:4])
+    return found
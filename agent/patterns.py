@@ -0,0 +1,22 @@
+# 文档编号类正则片段，规则分类（rule_classifier）与字段提取（field_extractor）共用，保证两处识别一致
+
+# 编号前不能紧跟字母数字；不用 \b，因为 Unicode 下汉字属于 \w，“专利号ZL…”中 ZL 前没有单词边界
+NO_ALNUM_BEFORE = r"(?<![A-Za-z0-9])"
+
+# 专利号：ZL 开头（可含空格），以及不带 ZL 的 12 位申请号加校验位
+PATENT_NO = r"ZL\s*\d{4}\s*[12389]\s*\d{7}\s*\.\s*[\dXx]"
+BARE_PATENT_NO = r"\d{4}[12389]\d{7}\.[\dXx]"
+
+# DOI 本体，以及其前缀：“doi:”、“DOI https://doi.org/”或单独的 doi.org 链接
+DOI = r"10\.\d{4,9}/[-._;()/:A-Za-z0-9]+"
+DOI_PREFIX = r"(?:doi\s*[:：]?\s*(?:https?://(?:dx\.)?doi\.org/)?|(?:https?://)?(?:dx\.)?doi\.org/)"
+
+# 国标（GB、GB/T、GB/Z）
+GB_STANDARD_NO = r"GB(?:/[TZ])?\s*\d{3,6}(?:\.\d+)?\s*[-—－]\s*\d{4}"
+# 地标、行标（DB11/T 1234-2020、JB/T 5000-2007）
+LOCAL_STANDARD_NO = r"(?:DB\d{2}(?:/T)?|(?!GB)[A-Z]{2}/T)\s*\d{3,6}(?:\.\d+)?\s*[-—－]\s*\d{4}"
+# 团标（T/CECS 123-2020），T 前不能是斜杠，避免匹配 GB/T、JB/T 的后半部分
+GROUP_STANDARD_NO = r"(?<![A-Za-z0-9/])T\s*/\s*[A-Z]{2,10}\s*\d{1,5}\s*[-—－]\s*\d{4}"
+
+# 软件著作权登记号（2020SR1234567）
+SOFTWARE_REG_NO = r"\d{4}\s*SR\s*\d{5,}"
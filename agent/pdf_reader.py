@@ -1,147 +1,358 @@
 import base64
 import os
-import aiofiles
+import re
+import unicodedata
 import fitz
 import pdfplumber
 import asyncio
-import aiohttp
+from concurrent.futures import Executor
+from typing import Iterable, List, Optional, Tuple
 from logging_config import logger
 from dotenv import load_dotenv
+from metrics import metrics
+from llm.client import chat_completion
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # WebP 编码依赖 opencv，未安装时退回 JPEG
+    cv2 = None
 
 # 加载环境变量
 load_dotenv()
-API_BASE_URL = os.getenv("API_BASE_URL")
-API_KEYS = os.getenv("API_KEYS", os.getenv("API_KEY", "")).split(",")  # 支持单key或多key
 TEXT_MODEL = os.getenv("TEXT_MODEL")
 VISION_MODEL = os.getenv("VISION_MODEL")
 
-MAX_CONCURRENCY = 3  # 最大并行请求数
+# 单个文档同时进行的 OCR 页数，只用于限制同时载入内存的页面图片；
+# 实际发往各后端的并发由 llm.router 按后端健康状况自适应调整
+MAX_CONCURRENCY = int(os.getenv("OCR_DOC_CONCURRENCY", "8"))
 MAX_RETRIES = 2       # 每张图片失败重试次数
+# 已渲染、等待 OCR 的页面队列长度，渲染快于 OCR 时生产者在此阻塞，限制内存占用
+OCR_PIPELINE_DEPTH = int(os.getenv("OCR_PIPELINE_DEPTH", "4"))
+
+# 批量 OCR：一次请求最多包含的页数（1 表示逐页请求）及图片数据总字节数上限，
+# 应按视觉模型的上下文长度与单次请求图片数量限制设置
+OCR_BATCH_PAGES = max(1, int(os.getenv("OCR_BATCH_PAGES", "1")))
+OCR_BATCH_MAX_BYTES = int(os.getenv("OCR_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# OCR 页面图片编码：png / jpeg / webp，有损格式的质量（1-100），是否转为灰度
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "jpeg").lower()
+OCR_IMAGE_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "85"))
+OCR_IMAGE_GRAYSCALE = os.getenv("OCR_IMAGE_GRAYSCALE", "false").lower() in ("1", "true", "yes")
+
+# 渲染分辨率按页面尺寸自适应：每页像素预算、长边像素上限（与视觉模型输入上限一致）、DPI 上下限
+OCR_PIXEL_BUDGET = int(os.getenv("OCR_PIXEL_BUDGET", "2000000"))
+OCR_MAX_LONG_EDGE = int(os.getenv("OCR_MAX_LONG_EDGE", "2048"))
+OCR_MIN_DPI = float(os.getenv("OCR_MIN_DPI", "72"))
+# 上限默认 144 DPI（原固定的 2 倍缩放），小于 A4 的页面不会比原来渲染得更大
+OCR_MAX_DPI = float(os.getenv("OCR_MAX_DPI", "144"))
+PDF_POINTS_PER_INCH = 72
+
+# 按页选择文本层或 OCR：有效字符数低于下限（且页面含图片或图形）或乱码比例超过上限的页才做 OCR
+OCR_HYBRID_ENABLED = os.getenv("OCR_HYBRID_ENABLED", "true").lower() in ("1", "true", "yes")
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "20"))
+OCR_MAX_GARBLED_RATIO = float(os.getenv("OCR_MAX_GARBLED_RATIO", "0.3"))
+
+_CID_RE = re.compile(r"\(cid:\d+\)")
+_PAGE_MARKER_RE = re.compile(r"^[ \t]*=+[ \t]*第[ \t]*(\d+)[ \t]*页[ \t]*=+[ \t]*$", re.M)
 
 
-async def pdf_text_reader(temp_file_path: str) -> str:
+# ===============================
+# CPU 密集步骤：在进程池中执行的同步函数
+# ===============================
+def extract_pdf_pages(temp_file_path: str) -> List[str]:
+    """使用 pdfplumber 逐页提取文本层，无文本的页为空字符串"""
     logger.info(f"开始处理PDF文件: {temp_file_path}")
     try:
         with pdfplumber.open(temp_file_path) as pdf:
-            all_text = ""
-            for page in pdf.pages:
-                text0 = page.extract_text()
-                if text0:
-                    all_text += text0 + "\n"
-        logger.debug(f"提取的文本内容前200字符: {all_text[:200]}...")
-        return all_text
+            pages = [page.extract_text() or "" for page in pdf.pages]
+        logger.debug(f"提取的文本内容前200字符: {join_pages(pages)[:200]}...")
+        return pages
     except Exception as e:
         logger.error(f"PDF解析失败: {str(e)}", exc_info=True)
-        return ""
+        return []
+
+
+def join_pages(pages: List[str]) -> str:
+    return "".join(page + "\n" for page in pages if page)
+
+
+def page_text_quality(text: str) -> Tuple[int, float]:
+    """文本层质量：(有效字符数, 乱码比例)；每个 (cid:NN) 字形、替换符、私用区与控制字符各计为一个乱码字符"""
+    cid_glyphs = len(_CID_RE.findall(text))
+    chars = [c for c in _CID_RE.sub("", text) if not c.isspace()]
+    garbled = sum(1 for c in chars if c == "\ufffd" or unicodedata.category(c) in ("Cc", "Co", "Cn", "Cs"))
+    total = cid_glyphs + len(chars)
+    return len(chars) - garbled, (cid_glyphs + garbled) / total if total else 0.0
+
 
+def pdf_visual_pages(temp_file_path: str, page_numbers: List[int]) -> List[int]:
+    """page_numbers 中含图片或矢量图形的页，用于区分扫描页与空白页"""
+    with fitz.open(temp_file_path) as pdf_document:
+        return [n for n in page_numbers
+                if pdf_document[n].get_images(full=False) or pdf_document[n].get_drawings()]
 
-async def image_to_base64(image_path: str) -> str:
+
+def extract_pdf_text(temp_file_path: str) -> str:
+    """使用 pdfplumber 提取文本层"""
+    return join_pages(extract_pdf_pages(temp_file_path))
+
+
+def _encode_pixmap(pix: "fitz.Pixmap") -> Tuple[str, bytes]:
+    """按配置的格式编码页面图片，返回 (MIME 类型, 图片字节)"""
+    if OCR_IMAGE_FORMAT == "webp" and cv2 is not None:
+        image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        if pix.n == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        ok, buffer = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, OCR_IMAGE_QUALITY])
+        if ok:
+            return "image/webp", buffer.tobytes()
+    if OCR_IMAGE_FORMAT in ("jpeg", "jpg", "webp"):
+        return "image/jpeg", pix.tobytes("jpeg", jpg_quality=OCR_IMAGE_QUALITY)
+    return "image/png", pix.tobytes("png")
+
+
+def render_zoom(width: float, height: float) -> float:
+    """
+    按页面尺寸（pt）计算渲染缩放倍数：在像素预算内取最大分辨率，并限制在 DPI 上下限之间，
+    最后保证长边不超过 OCR_MAX_LONG_EDGE（此时可能低于 OCR_MIN_DPI）；大幅面图纸自动降低 DPI，
+    小尺寸页面最多按 OCR_MAX_DPI 渲染。
+    """
+    if width <= 0 or height <= 0:
+        return 1.0
+    zoom = (OCR_PIXEL_BUDGET / (width * height)) ** 0.5
+    zoom = min(max(zoom, OCR_MIN_DPI / PDF_POINTS_PER_INCH), OCR_MAX_DPI / PDF_POINTS_PER_INCH)
+    return min(zoom, OCR_MAX_LONG_EDGE / max(width, height))
+
+
+def count_pdf_pages(temp_file_path: str) -> int:
+    with fitz.open(temp_file_path) as pdf_document:
+        logger.info(f"PDF总页数: {len(pdf_document)}")
+        return len(pdf_document)
+
+
+def render_pdf_page(temp_file_path: str, page_number: int) -> str:
+    """
+    使用 fitz 在内存中渲染单页并编码为 data URL（base64 只编码一次，重试时直接复用），
+    不写临时文件；渲染失败时返回空字符串。
+    """
+    if OCR_IMAGE_FORMAT == "webp" and cv2 is None:
+        logger.warning("未安装 opencv-python，无法编码 WebP，改用 JPEG")
+    colorspace = fitz.csGRAY if OCR_IMAGE_GRAYSCALE else fitz.csRGB
     try:
-        async with aiofiles.open(image_path, "rb") as f:
-            image_data = await f.read()
-            base64_image = base64.b64encode(image_data).decode("utf-8")
-            logger.debug(f"图片转换成功，大小: {len(base64_image)} bytes")
-            return base64_image
+        with fitz.open(temp_file_path) as pdf_document:
+            page = pdf_document.load_page(page_number)
+            zoom = render_zoom(page.rect.width, page.rect.height)
+            if zoom * PDF_POINTS_PER_INCH < OCR_MIN_DPI:
+                logger.warning(f"第 {page_number + 1} 页幅面过大，受长边上限 {OCR_MAX_LONG_EDGE}px 限制只能以 "
+                               f"{zoom * PDF_POINTS_PER_INCH:.0f} DPI 渲染，低于 OCR_MIN_DPI={OCR_MIN_DPI:.0f}")
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+        mime, data = _encode_pixmap(pix)
+        logger.debug(f"第 {page_number + 1} 页渲染成功: {zoom * PDF_POINTS_PER_INCH:.0f} DPI, "
+                     f"{pix.width}x{pix.height}, {mime}, {len(data)} bytes")
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
     except Exception as e:
-        logger.error(f"图片转Base64失败: {str(e)}", exc_info=True)
+        logger.error(f"第 {page_number + 1} 页转图片失败: {str(e)}", exc_info=True)
         return ""
 
 
-async def _ocr_single_image(session, image_path: str, api_key: str, idx: int) -> tuple[int, str]:
-    """单张图片异步OCR任务，返回(索引,文本)"""
-    for attempt in range(MAX_RETRIES + 1):
-        try:
-            base64_image = await image_to_base64(image_path)
-            if not base64_image:
-                return idx, ""
-
-            payload = {
-                "model": VISION_MODEL,
-                "messages": [{
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "请完整提取图片的文本信息"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
-                    ]
-                }]
-            }
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-
-            async with session.post(API_BASE_URL, json=payload, headers=headers,
-                                    timeout=aiohttp.ClientTimeout(total=400)) as resp:
-                resp.raise_for_status()
-                data = await resp.json()
-                text = data["choices"][0]["message"]["content"]
-                logger.info(f"OCR成功: {os.path.basename(image_path)}")
-                return idx, text
-
-        except Exception as e:
-            logger.warning(f"OCR第{attempt + 1}次失败: {image_path} | 错误: {e}")
-            await asyncio.sleep(2 ** attempt + 0.5)# 递增等待
-    return idx, ""
-
-
-async def extract_text_from_images(image_paths: list) -> str:
-    """使用 GPT 模型对图片进行并行 OCR"""
-    if not image_paths:
-        logger.warning("没有提供图片路径")
-        return ""
+# ===============================
+# 异步入口
+# ===============================
+async def pdf_text_reader(temp_file_path: str, executor: Optional[Executor] = None) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, extract_pdf_text, temp_file_path)
 
-    sem = asyncio.Semaphore(MAX_CONCURRENCY)
-    async with aiohttp.ClientSession() as session:
-        async def bound_task(idx, path):
-            async with sem:
-                api_key = API_KEYS[idx % len(API_KEYS)].strip()
-                return await _ocr_single_image(session, path, api_key, idx)
 
-        tasks = [bound_task(i, path) for i, path in enumerate(image_paths)]
-        results = await asyncio.gather(*tasks)
+async def pdf_page_reader(temp_file_path: str, executor: Optional[Executor] = None) -> List[str]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, extract_pdf_pages, temp_file_path)
 
-    # 保持原始顺序
-    results.sort(key=lambda x: x[0])
-    all_text = "\n".join(t for _, t in results if t)
-    return all_text
 
+async def _ocr_single_image(image_url: str, idx: int) -> tuple[int, str]:
+    """单页图片异步OCR任务，image_url 为 data URL，返回(索引,文本)"""
+    if not image_url:
+        return idx, ""
 
-async def pdf_pic_reader(temp_file_path: str) -> str:
-    """PDF 转图片后使用 GPT 模型并行 OCR"""
-    logger.info(f"开始处理PDF文件(图片模式): {temp_file_path}")
+    payload = {
+        "model": VISION_MODEL,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "请完整提取图片的文本信息"},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]
+        }]
+    }
 
-    pdf_dir = os.path.dirname(temp_file_path)
-    pdf_name = os.path.splitext(os.path.basename(temp_file_path))[0]
-    os.makedirs(pdf_dir, exist_ok=True)
-    image_paths = []
+    data = await chat_completion(payload, timeout=400, retries=MAX_RETRIES + 1, kind="vision",
+                                 cache_if=lambda d: bool(d["choices"][0]["message"]["content"].strip()))
+    if data is None:
+        logger.warning(f"OCR失败: 第 {idx + 1} 页")
+        return idx, ""
+    text = data["choices"][0]["message"]["content"]
+    logger.info(f"OCR成功: 第 {idx + 1} 页")
+    return idx, text
 
-    try:
-        pdf_document = fitz.open(temp_file_path)
-        logger.info(f"PDF总页数: {len(pdf_document)}")
 
-        for page_number in range(len(pdf_document)):
-            try:
-                page = pdf_document.load_page(page_number)
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                image_path = os.path.join(pdf_dir, f"{pdf_name}_page_{page_number + 1}.png")
-                pix.save(image_path)
-                image_paths.append(image_path)
-                logger.debug(f"生成图片成功: {image_path}")
-            except Exception as e:
-                logger.error(f"第 {page_number + 1} 页转图片失败: {str(e)}", exc_info=True)
+def split_batch_text(content: str, count: int) -> Optional[List[str]]:
+    """按“=== 第k页 ===”标记拆分批量 OCR 结果；标记缺失、重复或越界时返回 None"""
+    markers = list(_PAGE_MARKER_RE.finditer(content))
+    numbers = [int(m.group(1)) for m in markers]
+    if sorted(numbers) != list(range(1, count + 1)):
+        return None
+    texts = [""] * count
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(content)
+        texts[numbers[i] - 1] = content[marker.end():end].strip()
+    return texts
 
-        if not image_paths:
-            logger.error("未能生成任何图片")
-            return "PDF转图片失败，无法提取文本内容。"
 
-        logger.info(f"成功生成 {len(image_paths)} 张图片，开始并行OCR识别")
-        all_text = await extract_text_from_images(image_paths)
+async def _ocr_batch(batch: List[Tuple[int, str]]) -> List[str]:
+    """
+    多页图片放入同一条消息识别，batch 为 [(页码, data URL)]，返回与 batch 顺序一致的文本；
+    请求失败或结果无法按页拆分时回退为逐页请求。
+    """
+    if len(batch) == 1:
+        page_number, image_url = batch[0]
+        return [(await _ocr_single_image(image_url, page_number))[1]]
+
+    content = [{
+        "type": "text",
+        "text": f"以下依次为 {len(batch)} 页文档图片。请逐页完整提取图片的文本信息，"
+                f"每页文本前单独一行写“=== 第k页 ===”（k 为 1 到 {len(batch)} 的序号），不要合并或遗漏任何一页。",
+    }]
+    for k, (_, image_url) in enumerate(batch, 1):
+        content.append({"type": "text", "text": f"第{k}页："})
+        content.append({"type": "image_url", "image_url": {"url": image_url}})
+    payload = {"model": VISION_MODEL, "messages": [{"role": "user", "content": content}]}
 
-        # 清理图片
-        for img_path in image_paths:
+    pages = f"{batch[0][0] + 1}-{batch[-1][0] + 1}"
+    metrics.incr("ocr.batch.calls")
+    # 批量请求失败多与图片数量或体积有关，不再重试，直接回退逐页请求
+    data = await chat_completion(
+        payload, timeout=400, retries=1, kind="vision",
+        cache_if=lambda d: split_batch_text(d["choices"][0]["message"]["content"], len(batch)) is not None)
+    texts = split_batch_text(data["choices"][0]["message"]["content"], len(batch)) if data is not None else None
+    if texts is not None:
+        metrics.incr("ocr.batch.pages", len(batch))
+        logger.info(f"批量OCR成功: 第 {pages} 页")
+        return texts
+
+    metrics.incr("ocr.batch.fallback")
+    logger.warning(f"批量OCR失败或无法按页拆分，改为逐页识别: 第 {pages} 页")
+    results = await asyncio.gather(*(_ocr_single_image(image_url, page_number) for page_number, image_url in batch))
+    return [text for _, text in results]
+
+
+async def ocr_pdf_pages(temp_file_path: str, page_numbers: Iterable[int],
+                        executor: Optional[Executor] = None) -> List[str]:
+    """
+    渲染与 OCR 流水线：在 executor 中逐页渲染，按 OCR_BATCH_PAGES 分批放入有界队列，
+    OCR 协程取到一批即发起请求，不必等整份文档渲染完；
+    同时驻留内存的页面图片不超过（队列深度 + OCR 并发数）批。
+    返回与 page_numbers 顺序一致的文本，渲染或识别失败的页为空字符串。
+    """
+    loop = asyncio.get_running_loop()
+    page_numbers = list(page_numbers)
+    texts = [""] * len(page_numbers)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=OCR_PIPELINE_DEPTH)
+
+    async def consume():
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
             try:
-                os.remove(img_path)
-                logger.debug(f"已删除临时图片: {img_path}")
+                results = await _ocr_batch([(page_numbers[idx], image_url) for idx, image_url in batch])
+                for (idx, _), text in zip(batch, results):
+                    texts[idx] = text
             except Exception as e:
-                logger.warning(f"删除临时图片失败: {str(e)}")
+                pages = [page_numbers[idx] + 1 for idx, _ in batch]
+                logger.error(f"第 {pages} 页OCR异常: {str(e)}", exc_info=True)
+
+    consumers = [asyncio.ensure_future(consume()) for _ in range(min(MAX_CONCURRENCY, len(page_numbers)))]
+    try:
+        batch, batch_bytes = [], 0
+        for idx, page_number in enumerate(page_numbers):
+            image_url = await loop.run_in_executor(executor, render_pdf_page, temp_file_path, page_number)
+            if not image_url:
+                continue
+            metrics.incr("ocr.pages")
+            metrics.incr("ocr.image_bytes", len(image_url))
+            if batch and batch_bytes + len(image_url) > OCR_BATCH_MAX_BYTES:
+                await queue.put(batch)
+                batch, batch_bytes = [], 0
+            batch.append((idx, image_url))
+            batch_bytes += len(image_url)
+            if len(batch) >= OCR_BATCH_PAGES:
+                await queue.put(batch)
+                batch, batch_bytes = [], 0
+        if batch:
+            await queue.put(batch)
+        for _ in consumers:
+            await queue.put(None)
+        await asyncio.gather(*consumers)
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+    return texts
+
+
+async def pdf_hybrid_reader(temp_file_path: str, pages: List[str],
+                            executor: Optional[Executor] = None) -> Tuple[List[str], List[int]]:
+    """
+    按页混合文本层与 OCR：只渲染并识别文本层缺失或乱码的页，结果按页码放回原位置。
+    返回 (合并后的各页文本, 已 OCR 的页码)；OCR 失败的页保留原文本层。
+    """
+    garbled, short = [], []
+    for page_number, text in enumerate(pages):
+        chars, garbled_ratio = page_text_quality(text)
+        if garbled_ratio > OCR_MAX_GARBLED_RATIO:
+            garbled.append(page_number)
+        elif chars < OCR_MIN_PAGE_CHARS:
+            short.append(page_number)
+    if not garbled and not short:
+        return pages, []
+
+    loop = asyncio.get_running_loop()
+    try:
+        if short:
+            # 文字很少且没有图片或图形的页视为空白页，不必识别
+            short = await loop.run_in_executor(executor, pdf_visual_pages, temp_file_path, short)
+        ocr_pages = sorted(garbled + short)
+        metrics.incr("ocr.hybrid.documents")
+        metrics.incr("ocr.hybrid.text_pages", len(pages) - len(ocr_pages))
+        metrics.incr("ocr.hybrid.ocr_pages", len(ocr_pages))
+        if not ocr_pages:
+            return pages, []
+
+        logger.info(f"文本层缺失或乱码的页: {[n + 1 for n in ocr_pages]}（共 {len(pages)} 页），仅对这些页OCR")
+        texts = await ocr_pdf_pages(temp_file_path, ocr_pages, executor)
+    except Exception as e:
+        logger.error(f"按页OCR失败，使用原文本层: {str(e)}", exc_info=True)
+        return pages, []
+    merged = list(pages)
+    for page_number, text in zip(ocr_pages, texts):
+        if text:
+            merged[page_number] = text
+    return merged, ocr_pages
+
+
+async def pdf_pic_reader(temp_file_path: str, executor: Optional[Executor] = None) -> str:
+    """PDF 逐页渲染为内存图片，边渲染边使用 GPT 模型并行 OCR"""
+    logger.info(f"开始处理PDF文件(图片模式): {temp_file_path}")
+    loop = asyncio.get_running_loop()
+
+    try:
+        page_count = await loop.run_in_executor(executor, count_pdf_pages, temp_file_path)
+        if not page_count:
+            logger.error("PDF没有可渲染的页面")
+            return "PDF转图片失败，无法提取文本内容。"
 
+        logger.info(f"开始渲染并OCR识别 {page_count} 页")
+        texts = await ocr_pdf_pages(temp_file_path, range(page_count), executor)
+        all_text = "\n".join(t for t in texts if t)
         return all_text if all_text else "OCR识别未提取到文本内容"
 
     except Exception as e:
@@ -0,0 +1,275 @@
+import asyncio
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from logging_config import logger
+from metrics import metrics
+from agent.doc_detecter import detect_doc_type
+from agent.extract_agent import (
+    DOC_TYPES, PROMPT_VERSION, extract_info, extract_info_chunked, classify_and_extract, merge_fields,
+    is_missing, missing_required,
+)
+from agent.pdf_reader import (
+    OCR_HYBRID_ENABLED, pdf_page_reader, pdf_pic_reader, pdf_hybrid_reader, ocr_pdf_pages, join_pages,
+)
+from agent.prompt_budget import (
+    CLASSIFY_TOKEN_BUDGET, EXTRACT_TOKEN_BUDGET, classification_text, extraction_text, extraction_chunks,
+    estimate_tokens,
+)
+from agent.rule_classifier import classify_by_rules, RULE_CLASSIFIER_THRESHOLD
+from agent.field_extractor import extract_fields
+from agent import cascade
+from llm.router import router
+
+# separate：先分类再提取（两次调用）；combined：一次调用同时完成分类与提取
+EXTRACT_MODE = os.getenv("EXTRACT_MODE", "separate").lower()
+
+# 长文档（超出提取预算）的处理方式：window 只发送锚点附近的文本；map_reduce 按页分块并行提取后合并
+LONG_DOC_STRATEGY = os.getenv("LONG_DOC_STRATEGY", "window").lower()
+
+# 是否先用正则提取格式固定的字段（专利号、DOI、标准编号、日期等）
+FIELD_EXTRACTOR_ENABLED = os.getenv("FIELD_EXTRACTOR_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# 规则分类命中后，按该比例抽样在后台调用大模型核对，用于统计一致率
+RULE_CLASSIFIER_AUDIT_RATE = float(os.getenv("RULE_CLASSIFIER_AUDIT_RATE", "0.05"))
+
+metrics.register_ratio("rule_classifier.hit_rate", "rule_classifier.hit", "rule_classifier.total")
+metrics.register_ratio("rule_classifier.agreement", "rule_classifier.agreed", "rule_classifier.compared")
+metrics.register_ratio("prompt_budget.sent_ratio", "prompt_budget.tokens_sent", "prompt_budget.tokens_full")
+
+# 后台核对任务的强引用
+_audit_tasks = set()
+
+# 进程池只负责 CPU 密集的 PDF 解析与渲染，大模型调用全部在主事件循环上进行
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 4)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def result_fingerprint() -> str:
+    """影响提取结果的配置，作为结果缓存键的一部分"""
+    return "|".join((PROMPT_VERSION, EXTRACT_MODE, str(RULE_CLASSIFIER_THRESHOLD), str(FIELD_EXTRACTOR_ENABLED),
+                     str(CLASSIFY_TOKEN_BUDGET), str(EXTRACT_TOKEN_BUDGET), LONG_DOC_STRATEGY,
+                     os.getenv("SMALL_TEXT_MODEL", ""), str(OCR_HYBRID_ENABLED), router.model_fingerprint()))
+
+
+def parse_doc_type(raw_doc_type: str) -> str:
+    """只保留</think>后的内容，并归一为已知类型，无法识别时返回“其他”"""
+    doc_type = raw_doc_type.split("</think>")[-1].strip()
+    for known in DOC_TYPES:
+        if known in doc_type:
+            return known
+    return "其他"
+
+
+def format_result(doc_type: str, info: dict, filename: str) -> str:
+    if doc_type == "专利":
+        return f"文件: {filename}\n类型: 专利\n专利号：{info.get('专利号')}\n专利名称: {info.get('专利名称')}\n申请日期: {info.get('申请日期')}\n授权日期: {info.get('授权日期')}\n发明人: {info.get('发明人')}\n受让人: {info.get('受让人')}\n{'=' * 40}"
+
+    elif doc_type == "论文":
+        return f"""文件: {filename}
+                                类型: 论文
+                                标题: {info.get('标题', 'N/A')}
+                                作者: {info.get('作者', 'N/A')}
+                                期刊: {info.get('期刊', 'N/A')}
+                                年份: {str(info.get('year', 'N/A'))}
+                                DOI: {info.get('DOI', 'N/A')}
+                                收稿日期: {info.get('received_date', 'N/A')}
+                                接受日期: {info.get('accepted_date', 'N/A')}
+                                出版日期: {info.get('published_date', 'N/A')}
+                                项目编号: {info.get('project_number', 'N/A')}
+                                单位: {info.get('institution', 'N/A')}
+                                {'=' * 40}"""
+    elif doc_type == "标准":
+        return f"""文件: {filename}
+                                类型: 标准
+                                标准名称: {info.get('标准名称', 'N/A')}
+                                标准形式: {info.get('标准形式', 'N/A')}
+                                标准编号: {info.get('标准编号', 'N/A')}
+                                起草单位: {info.get('起草单位', 'N/A')}
+                                起草人: {info.get('起草人', 'N/A')}
+                                发布单位: {info.get('发布单位', 'N/A')}
+                                发布时间: {info.get('发布时间', 'N/A')}
+                                实施时间: {info.get('实施时间', 'N/A')}
+                                {'=' * 40}"""
+
+    elif doc_type == "软著":
+        return f"""文件: {filename}
+                                类型: 软著
+                                证书号: {info.get('证书号', 'N/A')}
+                                软件名称: {info.get('软件名称', 'N/A')}
+                                著作权人: {info.get('著作权人', 'N/A')}
+                                登记号: {info.get('登记号', 'N/A')}
+                                授权时间: {info.get('授权时间', 'N/A')}
+                                {'=' * 40}"""
+
+    return f"文件: {filename}\n类型: 未识别\n{'=' * 40}"
+
+
+def _record_agreement(rule_type: str, llm_type: str):
+    metrics.incr("rule_classifier.compared")
+    if rule_type == llm_type:
+        metrics.incr("rule_classifier.agreed")
+    else:
+        logger.info(f"规则分类与大模型不一致: 规则={rule_type}, 大模型={llm_type}")
+
+
+async def _audit_rule_result(text: str, rule_type: str):
+    _record_agreement(rule_type, parse_doc_type(await detect_doc_type(classification_text([text]))))
+
+
+def _classify_by_rules(text: str) -> tuple[Optional[str], str, float]:
+    """
+    规则分类，返回 (采用的类型, 规则猜测的类型, 置信度)。
+    置信度足够时采用规则结果，否则采用的类型为 None，交由大模型判断。
+    """
+    rule_type, confidence = classify_by_rules(text)
+    metrics.incr("rule_classifier.total")
+    if rule_type in DOC_TYPES and confidence >= RULE_CLASSIFIER_THRESHOLD:
+        metrics.incr("rule_classifier.hit")
+        logger.info(f"规则分类命中: {rule_type} (置信度 {confidence})")
+        if random.random() < RULE_CLASSIFIER_AUDIT_RATE:
+            task = asyncio.create_task(_audit_rule_result(text, rule_type))
+            _audit_tasks.add(task)
+            task.add_done_callback(_audit_tasks.discard)
+        return rule_type, rule_type, confidence
+    return None, rule_type, confidence
+
+
+def _extract_known_fields(text: str, doc_type: str) -> dict:
+    if not FIELD_EXTRACTOR_ENABLED:
+        return {}
+    known = extract_fields(text, doc_type)
+    metrics.incr("field_extractor.fields_found", len(known))
+    return known
+
+
+def _budgeted(text: str, full_text: str) -> str:
+    """记录按预算裁剪后实际发送的 Token 数"""
+    metrics.incr("prompt_budget.tokens_full", estimate_tokens(full_text))
+    metrics.incr("prompt_budget.tokens_sent", estimate_tokens(text))
+    return text
+
+
+async def _refill_from_full_text(windowed: str, text: str, doc_type: str, filename: str, info: dict) -> dict:
+    """窗口文本提取后必填字段缺失时，保留已得到的字段，用全文补提其余字段"""
+    if windowed.strip() == text.strip() or not missing_required(doc_type, info):
+        return info
+    metrics.incr("prompt_budget.fallback")
+    logger.info(f"窗口文本缺少必填字段，使用全文重新提取: {filename}")
+    found = {k: v for k, v in info.items() if k != "error" and not is_missing(v)}
+    return await extract_info(text, doc_type, filename, found)
+
+
+async def _classify_and_extract(pages: List[str], filename: str) -> Optional[tuple[str, dict]]:
+    """识别类型并提取信息，类型无法识别时返回 None"""
+    text = join_pages(pages)
+    if not text.strip():
+        logger.warning("输入文本为空，跳过文档类型检测")
+        return None
+
+    # 先走规则分类，命中时跳过大模型分类；规则与正则提取仍扫描全文
+    doc_type, rule_guess, confidence = _classify_by_rules(text)
+    known_fields = {}
+
+    def known_for(doc_type: str) -> dict:
+        if doc_type not in known_fields:
+            known_fields[doc_type] = _extract_known_fields(text, doc_type)
+        return known_fields[doc_type]
+
+    if doc_type is None and EXTRACT_MODE == "combined":
+        windowed = _budgeted(extraction_text(pages), text)
+
+        async def combined_call(kind: str) -> Optional[tuple[str, dict]]:
+            result = await classify_and_extract(windowed, filename, kind)
+            if result is None or result[0] not in DOC_TYPES:
+                return result
+            return result[0], merge_fields(result[0], result[1], known_for(result[0]))
+
+        combined = await cascade.classify_and_extract(combined_call, rule_guess, confidence, text)
+        if combined is not None:
+            doc_type, info = combined
+            if rule_guess in DOC_TYPES:
+                _record_agreement(rule_guess, doc_type)
+            if doc_type not in DOC_TYPES:
+                return None
+            info = await _refill_from_full_text(windowed, text, doc_type, filename, info)
+            info.update({"文件名": filename, "类型": doc_type})
+            return format_result(doc_type, info, filename), info
+        logger.warning(f"合并模式失败，回退到分步模式: {filename}")
+
+    if doc_type is None:
+        head = _budgeted(classification_text(pages), text)
+        doc_type = parse_doc_type(await cascade.classify(lambda kind: detect_doc_type(head, kind), rule_guess, confidence))
+        if rule_guess in DOC_TYPES:
+            _record_agreement(rule_guess, doc_type)
+    logger.debug(f"检测的 doc_type: {doc_type}")
+    if doc_type not in DOC_TYPES:
+        return None
+
+    known = known_for(doc_type)
+    if LONG_DOC_STRATEGY == "map_reduce" and 0 < EXTRACT_TOKEN_BUDGET < estimate_tokens(text):
+        chunks = extraction_chunks(pages, doc_type)
+        _budgeted("\n".join(chunks), text)
+        info = await cascade.extract(
+            lambda kind, fields: extract_info_chunked(chunks, doc_type, filename, fields, kind), doc_type, text, known)
+    else:
+        windowed = _budgeted(extraction_text(pages, doc_type), text)
+        info = await cascade.extract(
+            lambda kind, fields: extract_info(windowed, doc_type, filename, fields, kind), doc_type, text, known)
+        info = await _refill_from_full_text(windowed, text, doc_type, filename, info)
+    info.update({"文件名": filename, "类型": doc_type})
+    return format_result(doc_type, info, filename), info
+
+
+async def process_single_file(temp_file_path: str, filename: str) -> tuple[str, dict]:
+    """单文件处理流程：PDF 解析/渲染在进程池中执行，大模型调用在当前事件循环上并发"""
+    executor = get_executor()
+
+    pages = await pdf_page_reader(temp_file_path, executor)
+    ocr_done: List[int] = []
+    if OCR_HYBRID_ENABLED:
+        # 文本层缺失或乱码的页先单独 OCR，其余页仍使用文本层
+        pages, ocr_done = await pdf_hybrid_reader(temp_file_path, pages, executor)
+    outcome = await _classify_and_extract(pages, filename)
+    if outcome is not None:
+        return outcome
+
+    # 类型未识别，对尚未 OCR 的页提取图片文本
+    logger.info(f"未识别的文档类型，尝试通过图片提取文本: {filename}")
+    try:
+        if ocr_done:
+            done = set(ocr_done)
+            remaining = [n for n in range(len(pages)) if n not in done]
+            texts = await ocr_pdf_pages(temp_file_path, remaining, executor) if remaining else []
+            for page_number, page_text in zip(remaining, texts):
+                if page_text:
+                    pages[page_number] = page_text
+            text = join_pages(pages) if any(texts) else None
+        else:
+            text = await pdf_pic_reader(temp_file_path, executor)
+    except Exception as e:
+        logger.error(f"PDF 转图片失败: {e}")
+        text = None
+    logger.debug(f"重新检测的文本内容: {text[:2000] if text else '无文本'}")
+
+    outcome = await _classify_and_extract([text], filename) if text else None
+    if outcome is not None:
+        return outcome
+
+    # 如果仍未识别，则标记为未识别
+    return format_result("其他", {}, filename), {"文件名": filename, "类型": "未识别"}
@@ -0,0 +1,146 @@
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 各环节提示词中文档正文的 Token 预算，0 表示不限制（发送全文）
+CLASSIFY_TOKEN_BUDGET = int(os.getenv("CLASSIFY_TOKEN_BUDGET", "1500"))
+CLASSIFY_MAX_PAGES = int(os.getenv("CLASSIFY_MAX_PAGES", "2"))
+EXTRACT_TOKEN_BUDGET = int(os.getenv("EXTRACT_TOKEN_BUDGET", "4000"))
+# 锚点词前后截取的字符数
+WINDOW_CHARS = int(os.getenv("PROMPT_WINDOW_CHARS", "300"))
+# 长文档分块并行提取时的最大块数（超出时优先保留首块与含锚点词的块）
+MAP_REDUCE_MAX_CHUNKS = int(os.getenv("MAP_REDUCE_MAX_CHUNKS", "6"))
+# 抽取时首页（标题、作者、机构所在）占预算的比例
+HEAD_SHARE = 0.4
+
+_CJK_RE = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+# 各类型字段附近常见的锚点词，抽取时只发送这些位置附近的文本
+ANCHORS: Dict[str, List[str]] = {
+    "专利": ["专利号", "申请号", "申请日", "授权公告日", "授权日", "发明人", "专利权人", "受让人", "申请人",
+           "发明创造名称", "发明名称", "Patent No", "Inventor", "Assignee", "Applicant", "Filing Date", "Title"],
+    "论文": ["Received", "Revised", "Accepted", "Published", "DOI", "Funding", "Grant", "Acknowledg",
+           "Correspond", "Affiliation", "收稿日期", "修回日期", "录用日期", "基金项目", "资助", "作者简介", "通讯作者"],
+    "标准": ["发布", "实施", "起草单位", "起草人", "归口", "提出", "ICS", "GB", "T/", "DB"],
+    "软著": ["证书号", "登记号", "软件名称", "著作权人", "开发完成日期", "首次发表日期", "登记日期", "权利取得方式"],
+}
+_ANCHOR_RES = {
+    doc_type: re.compile("|".join(re.escape(a) for a in anchors), re.I)
+    for doc_type, anchors in ANCHORS.items()
+}
+_ALL_ANCHORS_RE = re.compile("|".join(re.escape(a) for anchors in ANCHORS.values() for a in anchors), re.I)
+
+
+# 同一文档在分类、抽取、统计时会被多次估算，缓存最近的结果（条目数较小，避免长期持有大文本）
+@lru_cache(maxsize=32)
+def estimate_tokens(text: str) -> int:
+    """本地估算 Token 数：中日韩字符约 1 字 1 Token，其余约 4 字符 1 Token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """按 Token 预算截断文本开头部分"""
+    if budget <= 0 or estimate_tokens(text) <= budget:
+        return text
+    used = 0.0
+    for i, char in enumerate(text):
+        used += 1 if _CJK_RE.match(char) else 0.25
+        if used > budget:
+            return text[:i]
+    return text
+
+
+def classification_text(pages: List[str]) -> str:
+    """分类只需要文档开头：取前几页并截断到分类预算"""
+    pages = [page for page in pages if page]
+    if CLASSIFY_MAX_PAGES > 0:
+        pages = pages[:CLASSIFY_MAX_PAGES]
+    return truncate_to_budget("\n".join(pages), CLASSIFY_TOKEN_BUDGET)
+
+
+def _anchor_spans(text: str, pattern: re.Pattern) -> List[Tuple[int, int]]:
+    """锚点附近的窗口，重叠的窗口合并"""
+    spans: List[Tuple[int, int]] = []
+    for match in pattern.finditer(text):
+        start, end = max(0, match.start() - WINDOW_CHARS), min(len(text), match.end() + WINDOW_CHARS)
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def extraction_text(pages: List[str], doc_type: Optional[str] = None) -> str:
+    """
+    抽取用的正文：全文不超预算时原样返回；否则保留首页开头，
+    再按文档顺序拼接各锚点词附近的窗口，直到用完预算。
+    doc_type 为空时（合并模式）使用所有类型的锚点。
+    """
+    full_text = "\n".join(page for page in pages if page)
+    if EXTRACT_TOKEN_BUDGET <= 0 or estimate_tokens(full_text) <= EXTRACT_TOKEN_BUDGET:
+        return full_text
+
+    first = next((page for page in pages if page), "")
+    head = truncate_to_budget(first, int(EXTRACT_TOKEN_BUDGET * HEAD_SHARE))
+    parts, used = [head], estimate_tokens(head)
+
+    pattern = _ANCHOR_RES.get(doc_type, _ALL_ANCHORS_RE)
+    rest = full_text[len(head):]
+    for start, end in _anchor_spans(rest, pattern):
+        window = rest[start:end]
+        cost = estimate_tokens(window)
+        if used + cost > EXTRACT_TOKEN_BUDGET:
+            window = truncate_to_budget(window, EXTRACT_TOKEN_BUDGET - used)
+            if window:
+                parts.append(window)
+            break
+        parts.append(window)
+        used += cost
+    return "\n...\n".join(parts)
+
+
+def page_chunks(pages: List[str], budget: int) -> List[str]:
+    """按页边界把文本切成不超过预算的块；单页超预算时在页内继续切分"""
+    chunks: List[str] = []
+    current: List[str] = []
+    used = 0
+    for page in pages:
+        while page:
+            cost = estimate_tokens(page)
+            if used + cost <= budget:
+                current.append(page)
+                used += cost
+                break
+            if current:
+                chunks.append("\n".join(current))
+                current, used = [], 0
+                continue
+            piece = truncate_to_budget(page, budget)
+            chunks.append(piece)
+            page = page[len(piece):]
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def extraction_chunks(pages: List[str], doc_type: str) -> List[str]:
+    """
+    分块并行提取用的文本块：每块不超过提取预算。
+    块数超过上限时保留首块（标题、作者）及含锚点词的块，仍按文档顺序排列。
+    """
+    chunks = page_chunks([page for page in pages if page], max(EXTRACT_TOKEN_BUDGET, 1))
+    if MAP_REDUCE_MAX_CHUNKS <= 0 or len(chunks) <= MAP_REDUCE_MAX_CHUNKS:
+        return chunks
+    pattern = _ANCHOR_RES.get(doc_type, _ALL_ANCHORS_RE)
+    ranked = sorted(range(1, len(chunks)), key=lambda i: -len(pattern.findall(chunks[i])))
+    keep = sorted([0] + [i for i in ranked[:MAP_REDUCE_MAX_CHUNKS - 1] if pattern.search(chunks[i])])
+    return [chunks[i] for i in keep]
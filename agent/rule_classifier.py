@@ -0,0 +1,77 @@
+import os
+import re
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from agent.patterns import (
+    DOI, DOI_PREFIX, GB_STANDARD_NO, GROUP_STANDARD_NO, LOCAL_STANDARD_NO, NO_ALNUM_BEFORE, PATENT_NO,
+    SOFTWARE_REG_NO,
+)
+
+load_dotenv()
+
+# 置信度达到阈值时直接采用规则结果，跳过大模型分类
+RULE_CLASSIFIER_THRESHOLD = float(os.getenv("RULE_CLASSIFIER_THRESHOLD", "0.6"))
+# 只扫描文本开头，避免论文参考文献中的专利号、标准号干扰判断
+RULE_CLASSIFIER_SCAN_CHARS = int(os.getenv("RULE_CLASSIFIER_SCAN_CHARS", "6000"))
+# 最高得分低于该值时视为证据不足
+MIN_SCORE = 5.0
+# 同一特征重复出现时最多计分次数
+MAX_REPEAT = 3
+
+# (正则, 权重)；权重越高表示该特征越能单独确定类型。编号类正则见 agent.patterns
+RULES: Dict[str, List[Tuple[re.Pattern, float]]] = {
+    "专利": [
+        (re.compile(NO_ALNUM_BEFORE + PATENT_NO), 6.0),
+        (re.compile(r"专利号|专利证书|专利权人|授权公告日|发明专利|实用新型"), 3.0),
+        (re.compile(r"申请号|申请日|发明人|发明创造名称"), 1.5),
+        (re.compile(r"\bpatent(?:s|ee)?\b|\bbrevet\b|\bPatentschrift\b", re.I), 2.5),
+    ],
+    "论文": [
+        (re.compile(NO_ALNUM_BEFORE + DOI_PREFIX + DOI, re.I), 6.0),
+        (re.compile(r"(?<![A-Za-z0-9.])" + DOI), 2.0),
+        (re.compile(r"\b(?:Received|Accepted|Revised|Published online)\s*[:：]?", re.I), 2.0),
+        (re.compile(r"\b(?:Abstract|Keywords|References|Introduction)\b|摘\s*要|关键词|参考文献", re.I), 1.5),
+        (re.compile(r"\b(?:Journal|Vol\.|Volume|ISSN)\b|期刊|学报", re.I), 1.0),
+    ],
+    "标准": [
+        (re.compile(NO_ALNUM_BEFORE + GB_STANDARD_NO), 6.0),
+        # 地标、行标（DB11/T 1234-2020、JB/T 5000-2007）与团标（T/CECS 123-2020）
+        (re.compile(NO_ALNUM_BEFORE + LOCAL_STANDARD_NO + "|" + GROUP_STANDARD_NO), 5.0),
+        (re.compile(r"中华人民共和国国家标准|团体标准|地方标准|行业标准|(?<![A-Za-z0-9])ICS\s*\d{2}"), 3.0),
+        (re.compile(r"起草单位|起草人|归口|\d{4}\s*[-年]\s*\d{1,2}\s*[-月]\s*\d{1,2}\s*日?\s*(?:发布|实施)"), 1.5),
+    ],
+    "软著": [
+        (re.compile(r"软著登字|计算机软件著作权登记证书"), 6.0),
+        (re.compile(NO_ALNUM_BEFORE + SOFTWARE_REG_NO), 5.0),
+        (re.compile(r"著作权人|开发完成日期|首次发表日期|权利取得方式"), 2.0),
+    ],
+}
+
+
+def score_text(text: str) -> Dict[str, float]:
+    head = text[:RULE_CLASSIFIER_SCAN_CHARS]
+    scores = {}
+    for doc_type, rules in RULES.items():
+        score = 0.0
+        for pattern, weight in rules:
+            hits = len(pattern.findall(head))
+            if hits:
+                score += weight * (1 + 0.25 * (min(hits, MAX_REPEAT) - 1))
+        scores[doc_type] = score
+    return scores
+
+
+def classify_by_rules(text: str) -> Tuple[str, float]:
+    """
+    基于正则与关键词权重的快速分类，返回 (类型, 置信度)。
+    置信度为最高分与次高分的相对差距，证据不足时返回 ("其他", 0.0)。
+    """
+    if not text or not text.strip():
+        return "其他", 0.0
+    ranked = sorted(score_text(text).items(), key=lambda item: item[1], reverse=True)
+    (best_type, best), (_, second) = ranked[0], ranked[1]
+    if best < MIN_SCORE:
+        return "其他", 0.0
+    return best_type, round((best - second) / best, 4)
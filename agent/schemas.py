@@ -0,0 +1,176 @@
+import re
+from typing import Any, ClassVar, Dict, List, Literal, Tuple, Type, Union
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+from agent.field_extractor import DATE, normalize_date
+
+NA = "N/A"
+_DATE_RE = re.compile(DATE, re.I)
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_DOI_RE = re.compile(r"^10\.\d{4,9}/\S+$")
+
+
+def is_missing(value: Any) -> bool:
+    return value is None or str(value).strip().upper() in ("", "N/A", "NA", "NULL", "NONE", "无")
+
+
+def _text(value: Any) -> Any:
+    """列表合并为“; ”分隔的文本，“无”“NULL”等空值写法统一为 N/A"""
+    if isinstance(value, (list, tuple)):
+        value = "; ".join(str(v).strip() for v in value if not is_missing(v))
+    if is_missing(value):
+        return NA
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value.strip() if isinstance(value, str) else value
+
+
+def _date(value: Any) -> Any:
+    """各种日期写法归一为 YYYY-MM-DD，无法识别时保留原值交由校验报错"""
+    value = _text(value)
+    if not isinstance(value, str) or value == NA or _ISO_DATE_RE.match(value):
+        return value
+    match = _DATE_RE.search(value)
+    return (normalize_date(match) or value) if match else value
+
+
+def _check_date(value: str) -> str:
+    if value != NA and not _ISO_DATE_RE.match(value):
+        raise ValueError("日期格式应为 YYYY-MM-DD")
+    return value
+
+
+class _ExtractionModel(BaseModel):
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+
+    # 子类中的日期字段名
+    DATE_FIELDS: ClassVar[Tuple[str, ...]] = ()
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _normalize(cls, value: Any, info) -> Any:
+        if info.field_name in cls.DATE_FIELDS:
+            return _date(value)
+        if info.field_name == "year":
+            return value
+        return _text(value)
+
+    @field_validator("*")
+    @classmethod
+    def _check(cls, value: Any, info) -> Any:
+        if info.field_name in cls.DATE_FIELDS:
+            return _check_date(value)
+        return value
+
+
+class PatentInfo(_ExtractionModel):
+    DATE_FIELDS = ("application_date", "grant_date")
+
+    patent_no: str = Field(NA, alias="专利号")
+    title: str = Field(NA, alias="专利名称")
+    application_date: str = Field(NA, alias="申请日期", description="YYYY-MM-DD")
+    grant_date: str = Field(NA, alias="授权日期", description="YYYY-MM-DD 或 N/A")
+    inventors: str = Field(NA, alias="发明人", description="以逗号分隔")
+    assignee: str = Field(NA, alias="受让人", description="公司或机构名称")
+
+
+class PaperInfo(_ExtractionModel):
+    DATE_FIELDS = ("received_date", "accepted_date", "published_date")
+
+    title: str = Field(NA, alias="标题")
+    authors: str = Field(NA, alias="作者", description="张三; 李四")
+    journal: str = Field(NA, alias="期刊")
+    year: Union[int, Literal["N/A"]] = Field(NA, alias="year")
+    doi: str = Field(NA, alias="DOI")
+    received_date: str = Field(NA, alias="received_date", description="YYYY-MM-DD")
+    accepted_date: str = Field(NA, alias="accepted_date", description="YYYY-MM-DD")
+    published_date: str = Field(NA, alias="published_date", description="YYYY-MM-DD")
+    project_number: str = Field(NA, alias="project_number")
+    institution: str = Field(NA, alias="institution")
+
+    @field_validator("year", mode="before")
+    @classmethod
+    def _year(cls, value: Any) -> Any:
+        value = _text(value)
+        if isinstance(value, str) and re.fullmatch(r"\d{4}", value):
+            return int(value)
+        return value
+
+    @field_validator("year")
+    @classmethod
+    def _year_range(cls, value: Any) -> Any:
+        if isinstance(value, int) and not 1900 <= value <= 2100:
+            raise ValueError("年份不合理")
+        return value
+
+    @field_validator("doi")
+    @classmethod
+    def _doi(cls, value: str) -> str:
+        value = re.sub(r"^(?:https?://(?:dx\.)?doi\.org/|doi\s*[:：]\s*)", "", value, flags=re.I)
+        if value != NA and not _DOI_RE.match(value):
+            raise ValueError("DOI 应以 10. 开头")
+        return value
+
+
+class StandardInfo(_ExtractionModel):
+    DATE_FIELDS = ("publish_date", "effective_date")
+
+    name: str = Field(NA, alias="标准名称")
+    form: Literal["国标", "地标", "团标", "行标", "N/A"] = Field(NA, alias="标准形式", description="国标/地标/团标")
+    number: str = Field(NA, alias="标准编号")
+    drafting_units: str = Field(NA, alias="起草单位")
+    drafters: str = Field(NA, alias="起草人")
+    publisher: str = Field(NA, alias="发布单位")
+    publish_date: str = Field(NA, alias="发布时间", description="YYYY-MM-DD")
+    effective_date: str = Field(NA, alias="实施时间", description="YYYY-MM-DD")
+
+
+class SoftwareInfo(_ExtractionModel):
+    DATE_FIELDS = ("grant_date",)
+
+    certificate_no: str = Field(NA, alias="证书号")
+    name: str = Field(NA, alias="软件名称")
+    owner: str = Field(NA, alias="著作权人")
+    registration_no: str = Field(NA, alias="登记号")
+    grant_date: str = Field(NA, alias="授权时间", description="YYYY-MM-DD")
+
+
+SCHEMA_MODELS: Dict[str, Type[_ExtractionModel]] = {
+    "专利": PatentInfo,
+    "论文": PaperInfo,
+    "标准": StandardInfo,
+    "软著": SoftwareInfo,
+}
+
+
+def json_schema(doc_type: str, fields: List[str]) -> Dict[str, Any]:
+    """只包含指定字段的 JSON Schema，用于 response_format 约束解码"""
+    schema = SCHEMA_MODELS[doc_type].model_json_schema(by_alias=True)
+    properties = {k: v for k, v in schema["properties"].items() if k in fields}
+    for prop in properties.values():
+        prop.pop("default", None)
+        prop.pop("title", None)
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+def validate_fields(doc_type: str, data: Any, fields: List[str]) -> Tuple[Dict[str, Any], Dict[str, Tuple[Any, str]]]:
+    """
+    按类型 schema 校验并归一化模型返回的字段，只处理 fields 中的字段。
+    返回 (有效字段, 无效字段 -> (原值, 错误原因))；data 不是 JSON 对象时全部视为无效。
+    """
+    if not isinstance(data, dict) or "error" in data:
+        return {}, {field: (None, "未返回有效 JSON") for field in fields}
+    model = SCHEMA_MODELS[doc_type]
+    data = {k: v for k, v in data.items() if k in fields}
+    invalid: Dict[str, Tuple[Any, str]] = {}
+    try:
+        parsed = model.model_validate(data)
+    except ValidationError as e:
+        for error in e.errors():
+            field = str(error["loc"][0]) if error["loc"] else ""
+            if field in fields and field not in invalid:
+                invalid[field] = (data.get(field), error["msg"])
+        parsed = model.model_validate({k: v for k, v in data.items() if k not in invalid})
+    dumped = parsed.model_dump(by_alias=True)
+    return {k: dumped[k] for k in fields if k not in invalid and k in dumped}, invalid
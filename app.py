@@ -1,27 +1,217 @@
+import ipaddress
 import json
 import os
 import shutil
+import socket
 import tempfile
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import List, Dict, Any, Optional
+from urllib.parse import urlparse, unquote
 
 import aiofiles
 import aiohttp
+from aiohttp.abc import AbstractResolver
+from yarl import URL
 
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
-executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 4)
 
 
 # 加载环境变量（如果有）
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from logging_config import logger
+from metrics import metrics
+from jobs import job_store
+from result_cache import result_cache, file_sha256, ResultCache
+from agent.pipeline import process_single_file, shutdown_executor, result_fingerprint
+from llm.client import open_session, close_session
+from llm.response_cache import response_cache
+from llm.router import router
 
 load_dotenv()
-app = FastAPI(title="文档信息提取服务", version="2.0.0")
+
+# 上传落盘配置：分块大小、单文件上限与单次请求上限（字节，0 表示不限制）
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_FILE_SIZE = int(os.getenv("MAX_UPLOAD_FILE_SIZE", str(200 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_SIZE = int(os.getenv("MAX_UPLOAD_REQUEST_SIZE", str(1024 * 1024 * 1024)))
+
+# URL 下载连接池配置
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "32"))
+DOWNLOAD_LIMIT_PER_HOST = int(os.getenv("DOWNLOAD_LIMIT_PER_HOST", "4"))
+DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "600"))
+
+# URL 下载安全限制：允许的主机（逗号分隔，以“.”开头表示该域名及其子域名；为空时允许任意公网主机）、
+# 是否禁止访问内网/本机/链路本地地址、单次请求 URL 数量上限、重定向次数上限
+DOWNLOAD_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("DOWNLOAD_ALLOWED_HOSTS", "").split(",") if h.strip()]
+DOWNLOAD_BLOCK_PRIVATE = os.getenv("DOWNLOAD_BLOCK_PRIVATE", "true").lower() in ("1", "true", "yes")
+MAX_DOWNLOAD_URLS = int(os.getenv("MAX_DOWNLOAD_URLS", "50"))
+DOWNLOAD_MAX_REDIRECTS = int(os.getenv("DOWNLOAD_MAX_REDIRECTS", "5"))
+
+# 任务事件流轮询间隔（秒）
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+# 参与结果缓存键的模型配置
+TEXT_MODEL = os.getenv("TEXT_MODEL")
+VISION_MODEL = os.getenv("VISION_MODEL")
+
+# 进程内复用的下载会话
+_download_session: Optional[aiohttp.ClientSession] = None
+
+
+def _host_allowed(host: str) -> bool:
+    """主机是否在白名单中；未配置白名单时返回 False"""
+    host = host.lower().rstrip(".")
+    return any(host == allowed or (allowed.startswith(".") and (host.endswith(allowed) or host == allowed[1:]))
+               for allowed in DOWNLOAD_ALLOWED_HOSTS)
+
+
+def _blocked_address(address: str) -> bool:
+    """内网、本机、链路本地（含云元数据 169.254.169.254）等非公网地址"""
+    try:
+        ip = ipaddress.ip_address(address.split("%")[0])
+    except ValueError:
+        return False
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not ip.is_global or ip.is_multicast
+
+
+class DownloadURLError(ValueError):
+    """URL 不允许下载"""
+
+
+def check_download_url(url: str):
+    """校验协议、主机白名单与字面量 IP；域名解析后的地址由 _PublicOnlyResolver 在连接时校验"""
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    if parsed.scheme not in ("http", "https") or not host:
+        raise DownloadURLError(f"不支持的URL: {url}")
+    if _host_allowed(host):
+        return
+    if DOWNLOAD_ALLOWED_HOSTS:
+        raise DownloadURLError(f"URL主机不在允许列表中: {url}")
+    if DOWNLOAD_BLOCK_PRIVATE and _blocked_address(host.strip("[]")):
+        raise DownloadURLError(f"禁止下载内网地址: {url}")
+
+
+class _PublicOnlyResolver(AbstractResolver):
+    """解析域名后拒绝指向内网地址的主机（白名单中的主机除外），重定向与 DNS 重绑定同样生效"""
+
+    def __init__(self):
+        self._resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET):
+        infos = await self._resolver.resolve(host, port, family)
+        if not _host_allowed(host):
+            for info in infos:
+                if _blocked_address(info["host"]):
+                    raise OSError(f"禁止下载内网地址: {host} -> {info['host']}")
+        return infos
+
+    async def close(self):
+        await self._resolver.close()
+
+
+class ByteBudget:
+    """单次请求内所有下载共享的字节额度"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def consume(self, size: int) -> bool:
+        self.used += size
+        return not self.limit or self.used <= self.limit
+
+
+def get_download_session() -> aiohttp.ClientSession:
+    """获取（必要时创建）共享的下载会话，按主机限制连接数"""
+    global _download_session
+    if _download_session is None or _download_session.closed:
+        connector = aiohttp.TCPConnector(limit=DOWNLOAD_MAX_CONNECTIONS, limit_per_host=DOWNLOAD_LIMIT_PER_HOST,
+                                         resolver=_PublicOnlyResolver() if DOWNLOAD_BLOCK_PRIVATE else None)
+        _download_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT),
+        )
+    return _download_session
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await open_session()
+    yield
+    if _download_session is not None and not _download_session.closed:
+        await _download_session.close()
+    await close_session()
+    shutdown_executor()
+
+
+class _RequestTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """
+    在 multipart 表单解析（整体落盘）之前限制上传请求体大小：
+    Content-Length 超限时直接返回 413，不读取请求体；未声明长度时边接收边计数，超限即中止。
+    """
+
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or []) if scope["type"] == "http" else {}
+        if not self.max_size or not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_size:
+            await self._reject(scope, receive, send)
+            return
+
+        received, exceeded, started = 0, False, False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    exceeded = True
+                    raise _RequestTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            # 超限后框架会把读取异常转换为 400 响应，改为返回 413
+            if exceeded:
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _RequestTooLarge:
+            pass
+        if exceeded and not started:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        logger.warning(f"上传请求超出单次请求大小限制: {scope.get('path')} (上限 {self.max_size} bytes)")
+        response = JSONResponse(status_code=413, content={"detail": f"上传内容超出单次请求大小限制 ({self.max_size} bytes)"})
+        await response(scope, receive, send)
+
+
+app = FastAPI(title="文档信息提取服务", version="2.0.0", lifespan=lifespan)
+
+app.add_middleware(UploadSizeLimitMiddleware, max_size=MAX_UPLOAD_REQUEST_SIZE)
 
 app.add_middleware(
     CORSMiddleware,
@@ -57,44 +247,86 @@ class ProcessResponse(BaseModel):
     data: Dict[str, dict]  # 每个文件的结构化数据以 id 为键
 
 
-async def download_from_url(url: str, save_path: str) -> bool:
-    """下载文件并显示进度信息"""
+class JobSubmitResponse(BaseModel):
+    job_id: str = Field(..., description="任务ID")
+    total: int = Field(..., description="任务包含的文件数")
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="running 或 done")
+    total: int
+    completed: int
+    results: Dict[str, str] = Field(default_factory=dict, description="已完成文件的结果，以 id 为键")
+    data: Dict[str, dict] = Field(default_factory=dict, description="已完成文件的结构化数据，以 id 为键")
+
+
+class ProcessUrlsRequest(BaseModel):
+    urls: List[str] = Field(..., description="待下载并处理的文件URL列表")
+
+
+async def _get_checked(session: aiohttp.ClientSession, url: str) -> aiohttp.ClientResponse:
+    """手动跟随重定向，每一跳都重新校验 URL"""
+    for _ in range(DOWNLOAD_MAX_REDIRECTS + 1):
+        check_download_url(url)
+        response = await session.get(url, allow_redirects=False)
+        location = response.headers.get("Location")
+        if response.status not in (301, 302, 303, 307, 308) or not location:
+            return response
+        response.release()
+        url = str(response.url.join(URL(location)))
+        logger.info(f"重定向到: {url}")
+    raise DownloadURLError(f"重定向次数超过 {DOWNLOAD_MAX_REDIRECTS} 次")
+
+
+async def download_from_url(url: str, save_path: str, session: Optional[aiohttp.ClientSession] = None,
+                            budget: Optional[ByteBudget] = None) -> bool:
+    """流式下载文件到磁盘并显示进度信息；budget 为本次请求所有下载共享的字节额度"""
+    session = session or get_download_session()
     try:
         logger.info(f"开始下载: {url}")
         logger.info(f"保存路径: {save_path}")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    # 获取文件大小（可能不可用）
-                    file_size = int(response.headers.get('content-length', 0))
+        async with await _get_checked(session, url) as response:
+            if response.status == 200:
+                # 获取文件大小（可能不可用）
+                file_size = int(response.headers.get('content-length', 0))
 
-                    # 显示下载基本信息
-                    logger.info(f"文件大小: {file_size / 1024:.2f} KB" if file_size else "文件大小: 未知")
+                # 显示下载基本信息
+                logger.info(f"文件大小: {file_size / 1024:.2f} KB" if file_size else "文件大小: 未知")
+                if MAX_UPLOAD_FILE_SIZE and file_size > MAX_UPLOAD_FILE_SIZE:
+                    logger.error(f"下载失败: 文件超出大小限制 ({MAX_UPLOAD_FILE_SIZE} bytes)")
+                    return False
 
-                    content = b''
-                    downloaded = 0
-                    async for chunk in response.content.iter_chunked(1024 * 8):  # 8KB chunks
-                        content += chunk
+                downloaded = 0
+                async with aiofiles.open(save_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(UPLOAD_CHUNK_SIZE):
                         downloaded += len(chunk)
+                        if MAX_UPLOAD_FILE_SIZE and downloaded > MAX_UPLOAD_FILE_SIZE:
+                            logger.error(f"下载失败: 文件超出大小限制 ({MAX_UPLOAD_FILE_SIZE} bytes)")
+                            return False
+                        if budget is not None and not budget.consume(len(chunk)):
+                            logger.error(f"下载失败: 超出单次请求大小限制 ({budget.limit} bytes)")
+                            return False
+                        await f.write(chunk)
 
                         # 显示下载进度（如果有文件大小信息）
                         if file_size > 0:
                             percent = downloaded / file_size * 100
                             logger.debug(f"下载进度: {percent:.1f}% ({downloaded}/{file_size} bytes)")
 
-                    # 保存文件
-                    async with aiofiles.open(save_path, "wb") as f:
-                        await f.write(content)
-
-                    logger.info(f"下载完成: {url}")
-                    return True
+                logger.info(f"下载完成: {url}")
+                return True
 
-                logger.error(f"下载失败: HTTP状态码 {response.status}")
-                return False
+            logger.error(f"下载失败: HTTP状态码 {response.status}")
+            return False
 
+    except DownloadURLError as e:
+        logger.error(f"下载被拒绝: {str(e)}")
     except aiohttp.ClientError as e:
         logger.error(f"网络错误: {str(e)}", exc_info=True)
+    except asyncio.TimeoutError:
+        logger.error(f"下载超时: {url}")
     except IOError as e:
         logger.error(f"文件保存错误: {str(e)}", exc_info=True)
     except Exception as e:
@@ -103,6 +335,51 @@ async def download_from_url(url: str, save_path: str) -> bool:
     return False
 
 
+def filename_from_url(url: str, idx: int) -> str:
+    """从 URL 路径推断文件名，无法推断时使用序号命名"""
+    name = os.path.basename(unquote(urlparse(url).path))
+    return name or f"file_{idx}.pdf"
+
+
+def _size_limit_error(filename: str, limit: int, scope: str) -> HTTPException:
+    logger.warning(f"上传超出{scope}大小限制: {filename} (上限 {limit} bytes)")
+    return HTTPException(status_code=413, detail=f"文件 {filename} 超出{scope}大小限制 ({limit} bytes)")
+
+
+def check_upload_sizes(files: List[UploadFile]):
+    """
+    根据各文件声明的大小拒绝超限上传，避免后续处理；此时表单已由框架解析落盘，
+    整个请求体的大小上限由 UploadSizeLimitMiddleware 在解析前检查。
+    """
+    total = 0
+    for file in files:
+        if file.size is None:
+            continue
+        if MAX_UPLOAD_FILE_SIZE and file.size > MAX_UPLOAD_FILE_SIZE:
+            raise _size_limit_error(file.filename, MAX_UPLOAD_FILE_SIZE, "单文件")
+        total += file.size
+        if MAX_UPLOAD_REQUEST_SIZE and total > MAX_UPLOAD_REQUEST_SIZE:
+            raise _size_limit_error(file.filename, MAX_UPLOAD_REQUEST_SIZE, "单次请求")
+
+
+async def save_upload_file(file: UploadFile, save_path: str, received: int = 0) -> int:
+    """按固定块大小将上传文件写入磁盘，返回本次请求累计已接收的字节数"""
+    written = 0
+    async with aiofiles.open(save_path, "wb") as f:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            received += len(chunk)
+            if MAX_UPLOAD_FILE_SIZE and written > MAX_UPLOAD_FILE_SIZE:
+                raise _size_limit_error(file.filename, MAX_UPLOAD_FILE_SIZE, "单文件")
+            if MAX_UPLOAD_REQUEST_SIZE and received > MAX_UPLOAD_REQUEST_SIZE:
+                raise _size_limit_error(file.filename, MAX_UPLOAD_REQUEST_SIZE, "单次请求")
+            await f.write(chunk)
+    return received
+
+
 def parse_date(date_str: str) -> Optional[datetime]:
 
     formats = [
@@ -117,190 +394,271 @@ def parse_date(date_str: str) -> Optional[datetime]:
             continue
     return None
 
-def process_single_file_sync(temp_file_path: str, filename: str) -> tuple[str, dict]:
-    """在进程池中运行的同步单文件处理逻辑"""
-    import asyncio
-    from agent.doc_detecter import detect_doc_type
-    from agent.extract_agent import extract_info
-    from agent.pdf_reader import pdf_text_reader, pdf_pic_reader
-
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
-    async def inner():
-        text = await pdf_text_reader(temp_file_path)
-        raw_doc_type = await detect_doc_type(text)
-        doc_type = raw_doc_type.split("</think>")[-1].strip()
-
-        if "专利" in doc_type:
-            info = await extract_info(text, "专利", filename)
-            info.update({"文件名": filename, "类型": "专利"})
-            result = f"文件: {filename}\n类型: 专利\n专利号：{info.get('专利号')}\n专利名称: {info.get('专利名称')}\n申请日期: {info.get('申请日期')}\n授权日期: {info.get('授权日期')}\n发明人: {info.get('发明人')}\n受让人: {info.get('受让人')}\n{'=' * 40}"
-
-        elif "论文" in doc_type:
-            info = await extract_info(text, "论文", filename)
-            info.update({"文件名": filename, "类型": "论文"})
-            result = f"""文件: {filename}
-                                类型: 论文
-                                标题: {info.get('标题', 'N/A')}
-                                作者: {info.get('作者', 'N/A')}
-                                期刊: {info.get('期刊', 'N/A')}
-                                年份: {str(info.get('year', 'N/A'))}
-                                DOI: {info.get('DOI', 'N/A')}
-                                收稿日期: {info.get('received_date', 'N/A')}
-                                接受日期: {info.get('accepted_date', 'N/A')}
-                                出版日期: {info.get('published_date', 'N/A')}
-                                项目编号: {info.get('project_number', 'N/A')} 
-                                单位: {info.get('institution', 'N/A')}    
-                                {'=' * 40}"""
-        elif "标准" in doc_type:
-            info = await extract_info(text, "标准", filename)
-            info.update({"文件名": filename, "类型": "标准"})
-            result = f"""文件: {filename}
-                                类型: 标准
-                                标准名称: {info.get('标准名称', 'N/A')}
-                                标准形式: {info.get('标准形式', 'N/A')}
-                                标准编号: {info.get('标准编号', 'N/A')}
-                                起草单位: {info.get('起草单位', 'N/A')}
-                                起草人: {info.get('起草人', 'N/A')}
-                                发布单位: {info.get('发布单位', 'N/A')}
-                                发布时间: {info.get('发布时间', 'N/A')}
-                                实施时间: {info.get('实施时间', 'N/A')}
-                                {'=' * 40}"""
-
-        elif "软著" in doc_type:
-            info = await extract_info(text, "软著", filename)
-            info.update({"文件名": filename, "类型": "软著"})
-            result = f"""文件: {filename}
-                                类型: 软著
-                                证书号: {info.get('证书号', 'N/A')}
-                                软件名称: {info.get('软件名称', 'N/A')}
-                                著作权人: {info.get('著作权人', 'N/A')}
-                                登记号: {info.get('登记号', 'N/A')}
-                                授权时间: {info.get('授权时间', 'N/A')}
-                                {'=' * 40}"""
-
-        else:
-            # 类型未识别，调用 pdf_pic_reader 提取文本
-            logger.info(f"未识别的文档类型，尝试通过图片提取文本: {filename}")
-            try:
-                text = await pdf_pic_reader(temp_file_path)  # 修改为直接处理临时文件路径
-            except Exception as e:
-                logger.error(f"PDF 转图片失败: {e}")
-                text = None
-            logger.debug(f"重新检测的文本内容: {text[:2000] if text else '无文本'}")
-            # 重新检测文档类型
-            raw_doc_type = await detect_doc_type(text) if text else "其他"
-            # 处理doc_type，只保留</think>后的内容
-            doc_type = raw_doc_type.split("</think>")[-1].strip()
-
-            logger.debug(f"重新检测的 doc_type: {doc_type}")
-
-            if "专利" in doc_type:
-                info = await extract_info(text, "专利", filename)
-                info.update({"文件名": filename, "类型": "专利"})
-                result = f"文件: {filename}\n类型: 专利\n专利号：{info.get('专利号')}\n专利名称: {info.get('专利名称')}\n申请日期: {info.get('申请日期')}\n授权日期: {info.get('授权日期')}\n发明人: {info.get('发明人')}\n受让人: {info.get('受让人')}\n{'=' * 40}"
-
-            elif "论文" in doc_type:
-                info = await extract_info(text, "论文", filename)
-                info.update({"文件名": filename, "类型": "论文"})
-                result = f"""文件: {filename}
-                                    类型: 论文
-                                    标题: {info.get('标题', 'N/A')}
-                                    作者: {info.get('作者', 'N/A')}
-                                    期刊: {info.get('期刊', 'N/A')}
-                                    年份: {str(info.get('year', 'N/A'))}
-                                    DOI: {info.get('DOI', 'N/A')}
-                                    收稿日期: {info.get('received_date', 'N/A')}
-                                    接受日期: {info.get('accepted_date', 'N/A')}
-                                    出版日期: {info.get('published_date', 'N/A')}
-                                    项目编号: {info.get('project_number', 'N/A')} 
-                                    单位: {info.get('institution', 'N/A')}    
-                                    {'=' * 40}"""
-            elif "标准" in doc_type:
-                info = await extract_info(text, "标准", filename)
-                info.update({"文件名": filename, "类型": "标准"})
-                result = f"""文件: {filename}
-                                    类型: 标准
-                                    标准名称: {info.get('标准名称', 'N/A')}
-                                    标准形式: {info.get('标准形式', 'N/A')}
-                                    标准编号: {info.get('标准编号', 'N/A')}
-                                    起草单位: {info.get('起草单位', 'N/A')}
-                                    起草人: {info.get('起草人', 'N/A')}
-                                    发布单位: {info.get('发布单位', 'N/A')}
-                                    发布时间: {info.get('发布时间', 'N/A')}
-                                    实施时间: {info.get('实施时间', 'N/A')}
-                                    {'=' * 40}"""
-
-            elif "软著" in doc_type:
-                info = await extract_info(text, "软著", filename)
-                info.update({"文件名": filename, "类型": "软著"})
-                result = f"""文件: {filename}
-                                    类型: 软著
-                                    证书号: {info.get('证书号', 'N/A')}
-                                    软件名称: {info.get('软件名称', 'N/A')}
-                                    著作权人: {info.get('著作权人', 'N/A')}
-                                    登记号: {info.get('登记号', 'N/A')}
-                                    授权时间: {info.get('授权时间', 'N/A')}
-                                    {'=' * 40}"""
+def _outcome_entry(file_id: str, outcome) -> tuple[str, dict]:
+    """将单个文件的处理结果（或异常）转换为响应中的 (结果文本, 结构化数据)"""
+    if isinstance(outcome, Exception):
+        return f"文件处理失败: {str(outcome)}", {"文件名": file_id, "类型": "处理失败"}
+    return outcome
 
-            else:
-                # 如果仍未识别，则标记为未识别
-                result = f"文件: {filename}\n类型: 未识别\n{'=' * 40}"
-                info = {"文件名": filename, "类型": "未识别"}
 
-        return result, info
+# 正在处理中的文件，按缓存键合并同一批次（或并发批次）中的相同文件
+_inflight_files: Dict[str, asyncio.Future] = {}
+
+# 只缓存成功识别并提取的结果，未识别可能源于临时的模型故障
+CACHEABLE_DOC_TYPES = ("专利", "论文", "标准", "软著")
 
-    try:
-        result, info = loop.run_until_complete(inner())
-    finally:
-        asyncio.set_event_loop(None)
 
-    return result, info
+def _rename_cached(cached_name: str, result: str, info: dict, filename: str) -> tuple[str, dict]:
+    """缓存结果中的文件名替换为本次上传的文件名"""
+    info = dict(info, 文件名=filename)
+    return result.replace(f"文件: {cached_name}", f"文件: {filename}", 1), info
+
+
+async def process_file(temp_file_path: str, filename: str) -> tuple[str, dict]:
+    """
+    处理单个文件：内容相同的文件（同一批次或并发批次中）只处理一次；
+    启用结果缓存时先查缓存，未命中时执行提取流程并写回缓存。
+    """
+    file_hash = await asyncio.to_thread(file_sha256, temp_file_path)
+    cache_key = ResultCache.make_key(file_hash, TEXT_MODEL, VISION_MODEL, result_fingerprint())
+    if result_cache is not None:
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"命中结果缓存: {filename} ({file_hash[:12]})")
+            return _rename_cached(*cached, filename)
+
+    pending = _inflight_files.get(cache_key)
+    if pending is None:
+        async def compute() -> tuple[str, str, dict]:
+            try:
+                result, info = await process_single_file(temp_file_path, filename)
+                if result_cache is not None and info.get("类型") in CACHEABLE_DOC_TYPES and "error" not in info:
+                    await asyncio.to_thread(result_cache.put, cache_key, file_hash, filename, result, info)
+                return filename, result, info
+            finally:
+                _inflight_files.pop(cache_key, None)
+
+        pending = _inflight_files[cache_key] = asyncio.ensure_future(compute())
+    else:
+        logger.info(f"相同文件正在处理，等待其结果: {filename} ({file_hash[:12]})")
+
+    return _rename_cached(*await asyncio.shield(pending), filename)
+
 
 @app.post("/api/v1/process_files", response_model=ProcessResponse)
 async def process_files(files: List[UploadFile] = File(...)):
     logger.info(f"开始处理文件上传请求，文件数量: {len(files)}")
+    check_upload_sizes(files)
     temp_dir = tempfile.mkdtemp()
     results = {}
     structured_data = {}
+    tasks = []
 
     try:
-        tasks = []
+        received = 0
         for idx, file in enumerate(files, start=1):
             file_id = f"id{idx}"
-            temp_file_path = os.path.join(temp_dir, file.filename)
+            # 加序号前缀，同名文件互不覆盖；原文件名只用于展示
+            temp_file_path = os.path.join(temp_dir, f"{idx}_{file.filename}")
             logger.info(f"保存文件 {idx}/{len(files)}: {file.filename}")
 
-            # 保存上传文件
-            async with aiofiles.open(temp_file_path, "wb") as f:
-                content = await file.read()
-                await f.write(content)
+            # 分块保存上传文件，超限时立即中止
+            received = await save_upload_file(file, temp_file_path, received)
 
             # 提交并行任务
-            loop = asyncio.get_running_loop()
-            task = loop.run_in_executor(executor, process_single_file_sync, temp_file_path, file.filename)
+            task = asyncio.ensure_future(process_file(temp_file_path, file.filename))
             tasks.append((file_id, task))
 
         # 并行等待结果
         done_results = await asyncio.gather(*[t for _, t in tasks], return_exceptions=True)
         for (file_id, _), result in zip(tasks, done_results):
-            if isinstance(result, Exception):
-                results[file_id] = f"文件处理失败: {str(result)}"
-                structured_data[file_id] = {"文件名": file_id, "类型": "处理失败"}
-            else:
-                res, info = result
-                results[file_id] = res
-                structured_data[file_id] = info
+            results[file_id], structured_data[file_id] = _outcome_entry(file_id, result)
 
+    except HTTPException:
+        # 超限中止时取消尚未开始的任务
+        for _, task in tasks:
+            task.cancel()
+        raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return ProcessResponse(results=results, data=structured_data)
 
 
+@app.post("/api/v1/process_urls", response_model=ProcessResponse)
+async def process_urls(request: ProcessUrlsRequest):
+    logger.info(f"开始处理URL下载请求，URL数量: {len(request.urls)}")
+    if MAX_DOWNLOAD_URLS and len(request.urls) > MAX_DOWNLOAD_URLS:
+        raise HTTPException(status_code=400, detail=f"URL数量超过上限 ({MAX_DOWNLOAD_URLS})")
+    for url in request.urls:
+        try:
+            check_download_url(url)
+        except DownloadURLError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    temp_dir = tempfile.mkdtemp()
+    results = {}
+    structured_data = {}
+    session = get_download_session()
+    budget = ByteBudget(MAX_UPLOAD_REQUEST_SIZE)
+
+    async def download_and_process(idx: int, url: str):
+        filename = filename_from_url(url, idx)
+        # 加序号前缀，避免不同URL同名文件互相覆盖
+        temp_file_path = os.path.join(temp_dir, f"{idx}_{filename}")
+        if not await download_from_url(url, temp_file_path, session, budget):
+            return filename, None
+        # 下载完成即提交处理，无需等待其他URL
+        result = await process_file(temp_file_path, filename)
+        return filename, result
+
+    try:
+        tasks = [download_and_process(idx, url) for idx, url in enumerate(request.urls, start=1)]
+        done_results = await asyncio.gather(*tasks, return_exceptions=True)
+        for idx, (url, outcome) in enumerate(zip(request.urls, done_results), start=1):
+            file_id = f"id{idx}"
+            if isinstance(outcome, Exception):
+                results[file_id], structured_data[file_id] = _outcome_entry(file_id, outcome)
+                continue
+            filename, result = outcome
+            if result is None:
+                results[file_id] = f"文件下载失败: {url}"
+                structured_data[file_id] = {"文件名": filename, "类型": "下载失败"}
+            else:
+                results[file_id], structured_data[file_id] = _outcome_entry(file_id, result)
     finally:
         shutil.rmtree(temp_dir, ignore_errors=True)
 
     return ProcessResponse(results=results, data=structured_data)
 
 
+# 后台任务的强引用，防止运行中的任务被垃圾回收
+_background_jobs = set()
+
+
+async def _run_job(job_id: str, temp_dir: str, items: List[tuple[str, str, str]]):
+    """后台逐个文件处理任务，每个文件完成后立即写入结果"""
+
+    async def run_one(file_id: str, temp_file_path: str, filename: str):
+        try:
+            outcome = await process_file(temp_file_path, filename)
+        except Exception as e:
+            logger.error(f"任务 {job_id} 文件处理失败: {filename} | {e}")
+            outcome = e
+        result, info = _outcome_entry(file_id, outcome)
+        await asyncio.to_thread(job_store.add_result, job_id, file_id, result, info)
+
+    try:
+        await asyncio.gather(*[run_one(*item) for item in items], return_exceptions=True)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        await asyncio.to_thread(job_store.finish, job_id)
+        logger.info(f"任务完成: {job_id}")
+
+
+@app.post("/api/v1/jobs", response_model=JobSubmitResponse)
+async def submit_job(files: List[UploadFile] = File(...)):
+    """提交批量提取任务，立即返回任务ID，结果通过轮询或事件流获取"""
+    logger.info(f"提交批量任务，文件数量: {len(files)}")
+    check_upload_sizes(files)
+    temp_dir = tempfile.mkdtemp()
+    items = []
+
+    try:
+        received = 0
+        for idx, file in enumerate(files, start=1):
+            temp_file_path = os.path.join(temp_dir, f"{idx}_{file.filename}")
+            received = await save_upload_file(file, temp_file_path, received)
+            items.append((f"id{idx}", temp_file_path, file.filename))
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    job_id = await asyncio.to_thread(job_store.create, len(items))
+    task = asyncio.create_task(_run_job(job_id, temp_dir, items))
+    _background_jobs.add(task)
+    task.add_done_callback(_background_jobs.discard)
+    logger.info(f"任务已创建: {job_id}")
+    return JobSubmitResponse(job_id=job_id, total=len(items))
+
+
+async def _get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+
+@app.get("/api/v1/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    job = await _get_job_or_404(job_id)
+    entries = await asyncio.to_thread(job_store.results_since, job_id)
+    return JobStatusResponse(
+        **job,
+        results={e["file_id"]: e["result"] for e in entries},
+        data={e["file_id"]: e["data"] for e in entries},
+    )
+
+
+@app.get("/api/v1/jobs/{job_id}/events")
+async def job_events(job_id: str, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """以 SSE 或 NDJSON 推送每个文件的结果，全部完成后发送 done 事件"""
+    await _get_job_or_404(job_id)
+
+    def encode(event: str, payload: Dict[str, Any]) -> str:
+        if format == "ndjson":
+            return json.dumps({"event": event, **payload}, ensure_ascii=False) + "\n"
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def stream():
+        last_seq = 0
+        while True:
+            # 先读状态再读结果，保证 done 之前的结果都已推送
+            job = await asyncio.to_thread(job_store.get, job_id)
+            if job is None:
+                return
+            entries = await asyncio.to_thread(job_store.results_since, job_id, last_seq)
+            for entry in entries:
+                last_seq = entry.pop("seq")
+                yield encode("result", entry)
+            if job["status"] == "done" and not entries:
+                yield encode("done", job)
+                return
+            if not entries:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    return StreamingResponse(stream(), media_type=media_type)
+
+
+@app.delete("/api/v1/cache/{file_hash}")
+async def invalidate_cache(file_hash: str):
+    """删除指定文件（SHA-256）的全部缓存结果"""
+    if result_cache is None:
+        raise HTTPException(status_code=404, detail="结果缓存未启用")
+    deleted = await asyncio.to_thread(result_cache.invalidate, file_hash.lower())
+    logger.info(f"清除文件缓存: {file_hash}，删除 {deleted} 条")
+    return {"deleted": deleted}
+
+
+@app.delete("/api/v1/cache")
+async def clear_cache():
+    """清空结果缓存，同时清空大模型响应缓存"""
+    if response_cache is not None:
+        await asyncio.to_thread(response_cache.clear)
+    if result_cache is None:
+        raise HTTPException(status_code=404, detail="结果缓存未启用")
+    deleted = await asyncio.to_thread(result_cache.clear)
+    logger.info(f"清空结果缓存，删除 {deleted} 条")
+    return {"deleted": deleted}
+
+
+@app.get("/api/v1/metrics")
+async def get_metrics():
+    """当前 worker 进程的运行统计，包括各大模型后端的在途请求数、近期耗时与错误率"""
+    return {**metrics.snapshot(), "backends": router.snapshot()}
+
+
 # 启动服务器
 if __name__ == "__main__":
     import uvicorn
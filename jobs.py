@@ -0,0 +1,94 @@
+# jobs.py
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from logging_config import logger
+
+# 任务状态存放在本地 SQLite 中，多个 uvicorn worker 共享同一个文件，
+# 因此提交任务与轮询/订阅结果可以落在不同的 worker 上。
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "shencha_jobs.sqlite3"))
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))  # 任务完成后保留结果的秒数
+
+
+class JobStore:
+    """批量提取任务的结果存储，按文件完成顺序追加结果"""
+
+    def __init__(self, db_path: str = JOB_DB_PATH, ttl: int = JOB_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, total INTEGER, created_at REAL, finished_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_results ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT, file_id TEXT, result TEXT, data TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_results_job ON job_results (job_id, seq)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create(self, total: int) -> str:
+        """登记新任务并清理过期任务，返回任务ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.ttl,)
+            )]
+            for old_id in expired:
+                conn.execute("DELETE FROM job_results WHERE job_id = ?", (old_id,))
+                conn.execute("DELETE FROM jobs WHERE job_id = ?", (old_id,))
+            if expired:
+                logger.info(f"清理过期任务 {len(expired)} 个")
+            conn.execute("INSERT INTO jobs (job_id, total, created_at) VALUES (?, ?, ?)", (job_id, total, now))
+        return job_id
+
+    def add_result(self, job_id: str, file_id: str, result: str, data: Dict[str, Any]):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_results (job_id, file_id, result, data) VALUES (?, ?, ?, ?)",
+                (job_id, file_id, result, json.dumps(data, ensure_ascii=False)),
+            )
+
+    def finish(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET finished_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """返回任务概况，任务不存在时返回 None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT total, finished_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            completed = conn.execute("SELECT COUNT(*) FROM job_results WHERE job_id = ?", (job_id,)).fetchone()[0]
+        total, finished_at = row
+        return {
+            "job_id": job_id,
+            "status": "done" if finished_at is not None else "running",
+            "total": total,
+            "completed": completed,
+        }
+
+    def results_since(self, job_id: str, after_seq: int = 0) -> List[Dict[str, Any]]:
+        """按完成顺序返回 seq 大于 after_seq 的文件结果"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, file_id, result, data FROM job_results WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after_seq),
+            ).fetchall()
+        return [
+            {"seq": seq, "file_id": file_id, "result": result, "data": json.loads(data)}
+            for seq, file_id, result, data in rows
+        ]
+
+
+job_store = JobStore()
@@ -0,0 +1,329 @@
+import asyncio
+import json
+import os
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import aiohttp
+from dotenv import load_dotenv
+
+from logging_config import logger
+from metrics import metrics
+from llm.governor import governor
+from llm.hedging import hedger
+from llm.response_cache import response_cache
+from llm.router import Backend, BackendUnavailable, router
+
+load_dotenv()
+
+IMAGE_TOKEN_ESTIMATE = 1000  # 每张图片按固定 Token 数预估
+
+# 进程内所有大模型请求共享的并发上限
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# 长连接池配置：连接总数 / 单主机连接数 / DNS 缓存秒数 / 空闲连接保活秒数 / 建连与单次读取超时（0 表示不限制）
+LLM_CONN_LIMIT = int(os.getenv("LLM_CONN_LIMIT", "32"))
+LLM_CONN_LIMIT_PER_HOST = int(os.getenv("LLM_CONN_LIMIT_PER_HOST", "16"))
+LLM_DNS_CACHE_TTL = int(os.getenv("LLM_DNS_CACHE_TTL", "300"))
+LLM_KEEPALIVE_TIMEOUT = float(os.getenv("LLM_KEEPALIVE_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_SOCK_READ_TIMEOUT = float(os.getenv("LLM_SOCK_READ_TIMEOUT", "0"))
+
+_session: Optional[aiohttp.ClientSession] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# 正在请求中的缓存键 -> 任务，相同请求并发到达时合并为一次上游调用
+_inflight: Dict[str, "asyncio.Future"] = {}
+
+metrics.register_ratio("llm_cache.hit_rate", "llm_cache.hit", "llm_cache.lookups")
+
+
+def _ensure_loop_state():
+    """会话与信号量绑定事件循环，循环变化（如脚本多次 asyncio.run）时重新创建"""
+    global _session, _semaphore, _loop, _inflight
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        _loop = loop
+        _session = None
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _inflight = {}
+
+
+def request_timeout(total: Optional[float]) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(total=total, connect=LLM_CONNECT_TIMEOUT or None,
+                                 sock_read=LLM_SOCK_READ_TIMEOUT or None)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """获取当前事件循环上共享的大模型会话，连接池在进程内所有请求间复用"""
+    global _session
+    _ensure_loop_state()
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=LLM_CONN_LIMIT,
+            limit_per_host=LLM_CONN_LIMIT_PER_HOST,
+            ttl_dns_cache=LLM_DNS_CACHE_TTL or None,
+            use_dns_cache=LLM_DNS_CACHE_TTL > 0,
+            keepalive_timeout=LLM_KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=request_timeout(None))
+    return _session
+
+
+async def open_session():
+    """服务启动时创建会话，避免首个请求承担初始化开销"""
+    get_session()
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def estimate_payload_tokens(payload: Dict[str, Any]) -> int:
+    """粗略估计请求消耗的 Token 数，用于 TPM 预扣"""
+    chars, images = 0, 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += 1
+    return chars // 2 + images * IMAGE_TOKEN_ESTIMATE + payload.get("max_tokens", 0)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数与 HTTP 日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def _read_stream(resp: aiohttp.ClientResponse, stop_when: Callable[[str], bool]) -> Dict[str, Any]:
+    """
+    逐行读取 SSE 流并拼接 delta 内容；stop_when 对已收到的内容返回 True 时立即停止读取，
+    退出响应上下文会关闭连接，服务端随之停止生成。返回与非流式响应相同的结构。
+    """
+    content, usage = "", None
+    async for raw in resp.content:
+        line = raw.decode("utf-8", "ignore").strip()
+        if not line.startswith("data:"):
+            continue
+        chunk = line[5:].strip()
+        if chunk == "[DONE]":
+            break
+        try:
+            event = json.loads(chunk)
+        except ValueError:
+            continue
+        if "error" in event:
+            return event
+        usage = event.get("usage") or usage
+        for choice in event.get("choices") or []:
+            content += (choice.get("delta") or {}).get("content") or ""
+        if stop_when(content):
+            metrics.incr("llm.stream_early_stop")
+            break
+    return {"choices": [{"message": {"content": content}}], "usage": usage}
+
+
+async def chat_completion(payload: Dict[str, Any], timeout: float = 400, retries: int = 3,
+                          kind: str = "text",
+                          stop_when: Optional[Callable[[str], bool]] = None,
+                          cache: bool = True, cache_ignore: Iterable[str] = (),
+                          cache_if: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Optional[Dict[str, Any]]:
+    """
+    调用 chat/completions，统一处理并发控制、Key轮换、限流与重试，失败返回 None。
+    kind 为 text、vision 或 small_text（级联中的小模型），决定路由到的后端池与模型，
+    并分别计入跨进程的在途请求上限（small_text 计入 text）。
+    传入 stop_when 时以 stream=True 请求，内容满足条件后提前结束读取。
+    成功的响应按提示词缓存，cache_ignore 中的内容（如文件名）不参与缓存键计算；
+    传入 cache_if 时只缓存其判定为可用的响应（如能解析出 JSON 或类型标签），以免重试时重放错误回答。
+    """
+    get_session()
+    if stop_when is not None:
+        payload = {**payload, "stream": True}
+    if response_cache is None or not cache:
+        return await _request_completion(payload, timeout, retries, kind, stop_when)
+
+    # 同一提示词在不同类别下由不同模型处理，类别需参与缓存键
+    cache_key = await asyncio.to_thread(response_cache.make_key, {**payload, "kind": kind}, tuple(cache_ignore))
+    metrics.incr("llm_cache.lookups")
+    data = await asyncio.to_thread(response_cache.get, cache_key)
+    if data is not None:
+        metrics.incr("llm_cache.hit")
+        return data
+
+    task = _inflight.get(cache_key)
+    if task is not None:
+        metrics.incr("llm_cache.hit")
+        metrics.incr("llm_cache.coalesced")
+        return await asyncio.shield(task)
+
+    metrics.incr("llm_cache.miss")
+
+    async def fetch() -> Optional[Dict[str, Any]]:
+        result = await _request_completion(payload, timeout, retries, kind, stop_when)
+        if result is not None and (cache_if is None or cache_if(result)):
+            await asyncio.to_thread(response_cache.put, cache_key, result)
+        elif result is not None:
+            metrics.incr("llm_cache.rejected")
+        return result
+
+    task = asyncio.ensure_future(fetch())
+    _inflight[cache_key] = task
+    task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+    return await asyncio.shield(task)
+
+
+async def _attempt(session: aiohttp.ClientSession, backend: Backend, api_key: str, payload: Dict[str, Any],
+                   timeout: float, kind: str, stop_when: Optional[Callable[[str], bool]], tokens: int,
+                   attempt: int) -> Optional[Dict[str, Any]]:
+    """
+    用指定后端与 Key 发出一次请求，向 Key 池与路由回报结果并归还后端并发名额；
+    成功返回响应数据，失败返回 None。
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    body = backend.prepare(payload, kind)
+    key_pool = backend.key_pool
+    try:
+        async with _semaphore, governor.slot(kind):
+            started = time.monotonic()
+            async with session.post(backend.url, json=body, headers=headers,
+                                    timeout=request_timeout(timeout)) as resp:
+                status = resp.status
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                if stop_when is not None and status < 400:
+                    data = await _read_stream(resp, stop_when)
+                else:
+                    data = await resp.json(content_type=None)
+    except asyncio.CancelledError:
+        # 对冲请求中落后的一方被取消，不计为失败
+        key_pool.release(api_key)
+        router.release(backend, kind, None, None)
+        raise
+    except Exception as e:
+        logger.warning(f"调用模型异常（{backend.name}，第{attempt + 1}次）: {e}")
+        key_pool.report(api_key, None)
+        router.release(backend, kind, None, False)
+        return None
+    elapsed = time.monotonic() - started
+    logger.debug(f"大模型响应: {data}")
+
+    if status < 400 and isinstance(data, dict) and "choices" in data:
+        usage = data.get("usage") or {}
+        key_pool.report(api_key, status, tokens_reserved=tokens, tokens_used=usage.get("total_tokens"))
+        router.release(backend, kind, elapsed, True)
+        if hedger is not None:
+            hedger.observe(kind, elapsed)
+        return data
+
+    # --- 限流检测：优先看状态码，兼容返回 200 但正文报限流的服务 ---
+    if status == 429 or "rate limit" in str(data).lower() or "tpm" in str(data).lower():
+        logger.warning(f"触发限流（{backend.name}，第{attempt + 1}次），切换API_KEY重试")
+        status = 429
+    else:
+        logger.error(f"调用模型失败（{backend.name}，第{attempt + 1}次，状态码 {status}）: {data}")
+        status = status if status >= 400 else 500
+    key_pool.report(api_key, status, retry_after)
+    router.release(backend, kind, elapsed, False, status)
+    return None
+
+
+async def _start_attempt(session: aiohttp.ClientSession, payload: Dict[str, Any], timeout: float, kind: str,
+                         stop_when: Optional[Callable[[str], bool]], tokens: int, attempt: int,
+                         avoid: Optional[Tuple[Backend, str]] = None) -> Tuple[Backend, str, "asyncio.Task"]:
+    """由路由选择后端、再从该后端的 Key 池取 Key 后发出请求；avoid 为需要避开的 (后端, Key)"""
+    backend = await router.acquire(kind, exclude={avoid[0].name} if avoid else None)
+    exclude_keys = {avoid[1]} if avoid and avoid[0] is backend else None
+    try:
+        api_key = await backend.key_pool.acquire(tokens, exclude=exclude_keys)
+    except BaseException:
+        router.release(backend, kind, None, None)
+        raise
+    task = asyncio.ensure_future(
+        _attempt(session, backend, api_key, payload, timeout, kind, stop_when, tokens, attempt))
+    return backend, api_key, task
+
+
+async def _hedged_attempt(session: aiohttp.ClientSession, payload: Dict[str, Any], timeout: float, kind: str,
+                          stop_when: Optional[Callable[[str], bool]], tokens: int,
+                          attempt: int) -> Optional[Dict[str, Any]]:
+    """
+    发出一次请求；超过对冲等待时间仍未返回且预算允许时，换一个后端（只有一个后端时换 Key）再发一份，
+    取先成功的结果并取消另一份。
+    """
+    backend, api_key, primary = await _start_attempt(session, payload, timeout, kind, stop_when, tokens, attempt)
+    if hedger is None:
+        return await primary
+
+    hedger.on_request()
+    pending = {primary}
+    starter = None
+    try:
+        delay = hedger.delay(kind)
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and hedger.try_spend():
+            # 对冲请求可能要等待后端名额或 Key 额度，等待期间主请求返回则放弃对冲
+            starter = asyncio.ensure_future(_start_attempt(session, payload, timeout, kind, stop_when, tokens,
+                                                           attempt, avoid=(backend, api_key)))
+            done, _ = await asyncio.wait({primary, starter}, return_when=asyncio.FIRST_COMPLETED)
+            if starter in done and not isinstance(starter.exception(), BackendUnavailable):
+                pending.add(starter.result()[2])
+                metrics.incr("llm.hedge.sent")
+                logger.info(f"请求超过 {delay:.1f}s 未返回，发出对冲请求（{kind}）")
+            elif starter not in done:
+                starter.cancel()
+                metrics.incr("llm.hedge.skipped")
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                data = task.result()
+                if data is not None:
+                    if task is not primary:
+                        metrics.incr("llm.hedge.won")
+                    return data
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if starter is not None:
+            if not starter.done():
+                starter.cancel()
+            elif not starter.cancelled() and starter.exception() is None:
+                starter.result()[2].cancel()
+
+
+async def _request_completion(payload: Dict[str, Any], timeout: float, retries: int, kind: str,
+                              stop_when: Optional[Callable[[str], bool]]) -> Optional[Dict[str, Any]]:
+    session = get_session()
+    tokens = estimate_payload_tokens(payload)
+    for attempt in range(retries):
+        # 每次尝试都重新选择后端，并从其 Key 池取剩余额度最多的 Key，被限流的 Key 会暂停使用
+        try:
+            data = await _hedged_attempt(session, payload, timeout, kind, stop_when, tokens, attempt)
+        except BackendUnavailable as e:
+            logger.error(f"{e}，放弃本次调用")
+            return None
+        if data is not None:
+            return data
+
+    logger.error("多次重试后仍失败")
+    return None
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import random
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from logging_config import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为进程内限流
+    fcntl = None
+
+load_dotenv()
+
+# 本机所有 uvicorn worker 及其子进程共享的大模型请求配额
+LLM_GOVERNOR_DIR = os.getenv("LLM_GOVERNOR_DIR", os.path.join(tempfile.gettempdir(), "shencha_llm_governor"))
+LLM_MAX_INFLIGHT_TEXT = int(os.getenv("LLM_MAX_INFLIGHT_TEXT", "6"))
+LLM_MAX_INFLIGHT_VISION = int(os.getenv("LLM_MAX_INFLIGHT_VISION", "3"))
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))  # 每分钟请求数上限，0 表示不限制
+
+POLL_INTERVAL = 0.05
+RPM_WINDOW = 60.0
+
+
+class LLMGovernor:
+    """
+    跨进程的大模型并发与速率控制。
+    每种请求（text / vision）对应一组槽位文件，持有某个文件的 flock 即占用一个在途名额；
+    进程退出时内核自动释放锁，不会泄漏名额。RPM 通过加锁的时间戳文件实现滑动窗口。
+    """
+
+    def __init__(self, directory: str, limits: Dict[str, int], rpm: int = 0):
+        self.directory = directory
+        self.limits = limits
+        self.rpm = rpm
+        self._slot_fds: Dict[str, List[int]] = {}
+        self._held: Dict[str, set] = {kind: set() for kind in limits}
+        self._local: Dict[str, asyncio.Semaphore] = {}
+        if fcntl is None:
+            logger.warning("当前平台不支持 fcntl，大模型并发仅在进程内限制")
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    def _fds(self, kind: str) -> List[int]:
+        if kind not in self._slot_fds:
+            self._slot_fds[kind] = [
+                os.open(os.path.join(self.directory, f"{kind}_{i}.lock"), os.O_RDWR | os.O_CREAT, 0o666)
+                for i in range(self.limits[kind])
+            ]
+        return self._slot_fds[kind]
+
+    def _try_acquire(self, kind: str) -> Optional[int]:
+        fds = self._fds(kind)
+        for i in random.sample(range(len(fds)), len(fds)):
+            if i in self._held[kind]:
+                continue
+            try:
+                fcntl.flock(fds[i], fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            self._held[kind].add(i)
+            return i
+        return None
+
+    def _release(self, kind: str, i: int):
+        fcntl.flock(self._fds(kind)[i], fcntl.LOCK_UN)
+        self._held[kind].discard(i)
+
+    def _reserve_rpm(self) -> float:
+        """在共享窗口中登记一次请求；超出 RPM 时不登记，返回需要等待的秒数"""
+        lock_path = os.path.join(self.directory, "rpm.lock")
+        log_path = os.path.join(self.directory, "rpm.log")
+        with open(lock_path, "a+") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                try:
+                    with open(log_path) as f:
+                        stamps = [float(line) for line in f if line.strip()]
+                except FileNotFoundError:
+                    stamps = []
+                stamps = [t for t in stamps if t > now - RPM_WINDOW]
+                if len(stamps) >= self.rpm:
+                    return stamps[0] + RPM_WINDOW - now
+                stamps.append(now)
+                with open(log_path, "w") as f:
+                    f.write("\n".join(f"{t:.3f}" for t in stamps))
+                return 0.0
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    async def _wait_rpm(self):
+        while True:
+            wait = await asyncio.to_thread(self._reserve_rpm)
+            if wait <= 0:
+                return
+            logger.debug(f"达到每分钟请求上限，等待 {wait:.2f}s")
+            await asyncio.sleep(wait + random.uniform(0, POLL_INTERVAL))
+
+    @asynccontextmanager
+    async def slot(self, kind: str = "text"):
+        """占用一个 kind 类型的在途名额，退出时释放；名额上限 ≤0 表示不限并发，只做 RPM 控制"""
+        kind = kind if kind in self.limits else "text"
+        if self.limits[kind] <= 0:
+            if fcntl is not None and self.rpm > 0:
+                await self._wait_rpm()
+            yield
+            return
+        if fcntl is None:
+            if kind not in self._local:
+                self._local[kind] = asyncio.Semaphore(self.limits[kind])
+            async with self._local[kind]:
+                yield
+            return
+
+        slot = self._try_acquire(kind)
+        while slot is None:
+            await asyncio.sleep(POLL_INTERVAL * random.uniform(0.5, 1.5))
+            slot = self._try_acquire(kind)
+        try:
+            if self.rpm > 0:
+                await self._wait_rpm()
+            yield
+        finally:
+            self._release(kind, slot)
+
+
+governor = LLMGovernor(
+    LLM_GOVERNOR_DIR,
+    {"text": LLM_MAX_INFLIGHT_TEXT, "vision": LLM_MAX_INFLIGHT_VISION},
+    LLM_RPM,
+)
@@ -0,0 +1,59 @@
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 对冲请求：超过历史耗时分位数仍未返回时，换 Key 再发一份，先返回的结果生效
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# 样本不足时使用的初始等待秒数 / 等待秒数下限
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "30"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+# 对冲请求数不超过普通请求数的该比例，避免整体负载失控
+LLM_HEDGE_BUDGET_RATIO = float(os.getenv("LLM_HEDGE_BUDGET_RATIO", "0.1"))
+
+MIN_SAMPLES = 20
+WINDOW_SIZE = 200
+MAX_CREDITS = 5.0  # 允许短时间内集中发出的对冲请求数
+
+
+class Hedger:
+    """按请求类别记录近期耗时，给出对冲等待时间，并以令牌方式限制对冲请求总量"""
+
+    def __init__(self, percentile: float = LLM_HEDGE_PERCENTILE, budget_ratio: float = LLM_HEDGE_BUDGET_RATIO):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._credits = 1.0
+
+    def observe(self, kind: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=WINDOW_SIZE)).append(seconds)
+
+    def delay(self, kind: str) -> float:
+        with self._lock:
+            samples = sorted(self._latencies.get(kind, ()))
+        if len(samples) < MIN_SAMPLES:
+            return LLM_HEDGE_INITIAL_DELAY
+        index = min(len(samples) - 1, int(len(samples) * self.percentile))
+        return max(LLM_HEDGE_MIN_DELAY, samples[index])
+
+    def on_request(self):
+        """每个普通请求为对冲预算积累额度"""
+        with self._lock:
+            self._credits = min(MAX_CREDITS, self._credits + self.budget_ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credits < 1:
+                return False
+            self._credits -= 1
+            return True
+
+
+hedger = Hedger() if LLM_HEDGE_ENABLED else None
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from llm.governor import LLM_GOVERNOR_DIR
+from logging_config import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为进程内 Key 状态
+    fcntl = None
+
+load_dotenv()
+
+# 单个 Key 的每分钟请求数 / Token 数预算，本机所有服务进程共享，0 表示不限制
+API_KEY_RPM = int(os.getenv("API_KEY_RPM", "0"))
+API_KEY_TPM = int(os.getenv("API_KEY_TPM", "0"))
+
+RATE_LIMIT_BENCH_BASE = 5.0   # 限流且未给出 Retry-After 时的基础暂停秒数
+FAILURE_BENCH_BASE = 1.0      # 请求失败时的基础暂停秒数
+MAX_BENCH_SECONDS = 300.0
+AUTH_BENCH_SECONDS = 300.0    # 401/403 通常是 Key 本身失效
+
+# 跨进程共享的 Key 状态字段；inflight 只用于进程内排序，不共享
+SHARED_FIELDS = ("rpm_tokens", "tpm_tokens", "updated", "benched_until", "failures", "last_used")
+
+
+class _KeyState:
+    def __init__(self, key: str, rpm: int, tpm: int):
+        self.key = key
+        # 共享文件中只记录 Key 的摘要，不落盘明文
+        self.key_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        self.rpm_tokens = float(rpm)
+        self.tpm_tokens = float(tpm)
+        self.updated = time.time()
+        self.benched_until = 0.0
+        self.failures = 0
+        self.inflight = 0
+        self.last_used = 0.0
+
+
+class KeyPool:
+    """
+    按 Key 维护 RPM/TPM 令牌桶，每次选择剩余额度最多的可用 Key；
+    被限流或连续失败的 Key 暂停使用，暂停时长优先取 Retry-After，否则指数退避。
+    令牌桶与暂停状态保存在 LLM_GOVERNOR_DIR 下按后端命名的状态文件中，读写时持有 flock，
+    因此多个 uvicorn worker 共用同一份额度，一个进程遇到的 429 也会让其他进程避开该 Key。
+    """
+
+    def __init__(self, keys: List[str], rpm: int = 0, tpm: int = 0, name: str = "default",
+                 directory: str = LLM_GOVERNOR_DIR):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._states: Dict[str, _KeyState] = {k: _KeyState(k, rpm, tpm) for k in (keys or [""])}
+        self._path = None
+        if fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._path = os.path.join(directory, f"keys_{name}.json")
+
+    @contextmanager
+    def _shared(self):
+        """加锁载入其他进程写入的 Key 状态，正常退出时写回；不支持 fcntl 时只使用进程内状态"""
+        if self._path is None:
+            yield
+            return
+        with open(self._path + ".lock", "a+") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._path) as f:
+                        saved = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    saved = {}
+                for state in self._states.values():
+                    for field, value in (saved.get(state.key_id) or {}).items():
+                        if field in SHARED_FIELDS:
+                            setattr(state, field, value)
+                yield
+                saved.update({state.key_id: {field: getattr(state, field) for field in SHARED_FIELDS}
+                              for state in self._states.values()})
+                with open(self._path, "w") as f:
+                    json.dump(saved, f)
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _refill(self, state: _KeyState, now: float):
+        elapsed = now - state.updated
+        state.updated = now
+        if self.rpm:
+            state.rpm_tokens = min(self.rpm, state.rpm_tokens + elapsed * self.rpm / 60)
+        if self.tpm:
+            state.tpm_tokens = min(self.tpm, state.tpm_tokens + elapsed * self.tpm / 60)
+
+    def _capacity(self, state: _KeyState) -> float:
+        """剩余额度比例，不限额时为 1"""
+        ratios = [1.0]
+        if self.rpm:
+            ratios.append(state.rpm_tokens / self.rpm)
+        if self.tpm:
+            ratios.append(state.tpm_tokens / self.tpm)
+        return min(ratios)
+
+    def _wait_time(self, state: _KeyState, now: float, tokens: int) -> float:
+        """该 Key 恢复到可发出一次请求所需的秒数"""
+        wait = max(0.0, state.benched_until - now)
+        if self.rpm and state.rpm_tokens < 1:
+            wait = max(wait, (1 - state.rpm_tokens) * 60 / self.rpm)
+        if self.tpm:
+            need = min(tokens, self.tpm)
+            if state.tpm_tokens < need:
+                wait = max(wait, (need - state.tpm_tokens) * 60 / self.tpm)
+        return wait
+
+    def _take(self, candidates: List[_KeyState], tokens: int) -> Tuple[Optional[str], Optional[float]]:
+        """选出剩余额度最多的可用 Key 并扣除额度；没有可用 Key 时返回 (None, 最早恢复的等待秒数)"""
+        with self._shared():
+            now = time.time()
+            best, soonest = None, None
+            for state in candidates:
+                self._refill(state, now)
+                wait = self._wait_time(state, now, tokens)
+                if wait > 0:
+                    soonest = wait if soonest is None else min(soonest, wait)
+                    continue
+                rank = (self._capacity(state), -state.inflight, -state.last_used)
+                if best is None or rank > best[0]:
+                    best = (rank, state)
+
+            if best is None:
+                return None, soonest
+            state = best[1]
+            if self.rpm:
+                state.rpm_tokens -= 1
+            if self.tpm:
+                state.tpm_tokens -= tokens
+            state.inflight += 1
+            state.last_used = now
+            return state.key, None
+
+    async def acquire(self, tokens: int = 0, exclude: Optional[Set[str]] = None) -> str:
+        """
+        取出一个可用 Key 并扣除额度，全部不可用时等待最早恢复的 Key。
+        exclude 中的 Key 不参与选择（如对冲请求避开原请求的 Key），只有一个 Key 时忽略该参数。
+        """
+        candidates = [state for state in self._states.values() if not exclude or state.key not in exclude]
+        candidates = candidates or list(self._states.values())
+        while True:
+            # 状态文件只在选择期间短暂加锁，直接在事件循环中读写
+            key, soonest = self._take(candidates, tokens)
+            if key is not None:
+                return key
+            logger.debug(f"所有 API Key 暂不可用，等待 {soonest:.2f}s")
+            await asyncio.sleep(min(soonest, MAX_BENCH_SECONDS))
+
+    def release(self, key: str):
+        """请求被主动取消时归还在途计数，不计为失败"""
+        state = self._states.get(key)
+        if state is not None:
+            state.inflight = max(0, state.inflight - 1)
+
+    def report(self, key: str, status: Optional[int], retry_after: Optional[float] = None,
+               tokens_reserved: int = 0, tokens_used: Optional[int] = None):
+        """
+        回报一次请求结果。status 为 HTTP 状态码，网络异常或超时传 None；
+        成功时按实际用量修正 TPM 预扣额度。
+        """
+        state = self._states.get(key)
+        if state is None:
+            return
+        state.inflight = max(0, state.inflight - 1)
+        with self._shared():
+            self._record(state, status, retry_after, tokens_reserved, tokens_used)
+
+    def _record(self, state: _KeyState, status: Optional[int], retry_after: Optional[float],
+                tokens_reserved: int, tokens_used: Optional[int]):
+        if status is not None and status < 400:
+            state.failures = 0
+            if self.tpm and tokens_used is not None:
+                state.tpm_tokens = min(self.tpm, state.tpm_tokens + tokens_reserved - tokens_used)
+            return
+
+        state.failures += 1
+        if status == 429:
+            bench = retry_after if retry_after is not None else RATE_LIMIT_BENCH_BASE * 2 ** (state.failures - 1)
+            if self.rpm:
+                state.rpm_tokens = min(state.rpm_tokens, 0.0)
+        elif status in (401, 403):
+            bench = AUTH_BENCH_SECONDS
+        else:
+            bench = FAILURE_BENCH_BASE * 2 ** (state.failures - 1)
+        bench = min(bench, MAX_BENCH_SECONDS)
+        state.benched_until = max(state.benched_until, time.time() + bench)
+        logger.warning(f"API Key ...{state.key[-4:]} 暂停 {bench:.1f}s（状态: {status}，连续失败 {state.failures} 次）")
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from logging_config import logger
+
+load_dotenv()
+
+# 提示词级响应缓存：内存 LRU 条目数 / 磁盘缓存路径（为空时只用内存）/ 过期秒数
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _normalize_text(text: str, ignore: Iterable[str]) -> str:
+    for part in ignore:
+        if part:
+            text = text.replace(part, "")
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _normalize_messages(messages: list, ignore: Iterable[str]) -> list:
+    """统一空白并去掉与结果无关的内容（如文件名）；图片只保留摘要"""
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts = [_normalize_text(content, ignore)]
+        else:
+            parts = []
+            for part in content or []:
+                if part.get("type") == "text":
+                    parts.append(_normalize_text(part.get("text", ""), ignore))
+                elif part.get("type") == "image_url":
+                    url = (part.get("image_url") or {}).get("url", "")
+                    parts.append("image:" + hashlib.sha256(url.encode("utf-8")).hexdigest())
+        normalized.append([message.get("role"), parts])
+    return normalized
+
+
+class ResponseCache:
+    """以 (模型, 归一化提示词哈希, 请求参数) 为键的大模型响应缓存，内存 LRU + 可选的 SQLite 磁盘层"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, db_path: str = LLM_CACHE_PATH,
+                 ttl: float = LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (cache_key TEXT PRIMARY KEY, data TEXT, expires_at REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_expires_at ON responses (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any], ignore: Iterable[str] = ()) -> str:
+        ignore = tuple(ignore)
+        params = {k: v for k, v in payload.items() if k not in ("model", "messages")}
+        prompt = json.dumps(_normalize_messages(payload.get("messages", []), ignore), ensure_ascii=False)
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps([payload.get("model"), prompt_hash, params], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(cache_key)
+                    return entry[1]
+                del self._memory[cache_key]
+        if not self.db_path:
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT data, expires_at FROM responses WHERE cache_key = ? AND expires_at > ?", (cache_key, now)
+            ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        self._remember(cache_key, row[1], data)
+        return data
+
+    def put(self, cache_key: str, data: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        self._remember(cache_key, expires_at, data)
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                             (cache_key, json.dumps(data, ensure_ascii=False), expires_at))
+                conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def _remember(self, cache_key: str, expires_at: float, data: Dict[str, Any]):
+        with self._lock:
+            self._memory[cache_key] = (expires_at, data)
+            self._memory.move_to_end(cache_key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._memory)
+            self._memory.clear()
+        if self.db_path:
+            with self._connect() as conn:
+                count = max(count, conn.execute("DELETE FROM responses").rowcount)
+        logger.info(f"已清空大模型响应缓存: {count} 条")
+        return count
+
+
+response_cache = ResponseCache() if LLM_CACHE_ENABLED else None
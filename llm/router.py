@@ -0,0 +1,243 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from logging_config import logger
+from metrics import metrics
+from llm.key_pool import KeyPool, API_KEY_RPM, API_KEY_TPM
+
+load_dotenv()
+
+# 多个 OpenAI 兼容后端，逗号分隔的名称列表；每个后端通过 LLM_BACKEND_<名称>_* 配置。
+# 未配置时使用 API_BASE_URL / API_KEY / TEXT_MODEL / VISION_MODEL 作为唯一后端。
+LLM_BACKENDS = [name.strip() for name in os.getenv("LLM_BACKENDS", "").split(",") if name.strip()]
+
+EWMA_ALPHA = 0.2
+DEFAULT_LATENCY = 5.0      # 尚无样本时假定的耗时（秒）
+ERROR_PENALTY = 5.0        # 错误率对选择得分的放大系数
+
+# 自适应并发（AIMD）：健康时每完成约一轮请求上限 +1，遇到限流、5xx 或超时时上限减半；
+# 配置的 MAX_CONCURRENCY 作为上限的最大值
+LLM_AIMD_ENABLED = os.getenv("LLM_AIMD_ENABLED", "true").lower() in ("1", "true", "yes")
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_DECREASE_INTERVAL = 1.0   # 同一波失败只减一次（秒）
+HEALTHY_LATENCY_FACTOR = 2.0   # 耗时不超过近期均值的该倍数视为健康
+
+# 熔断：连续失败达到次数后在冷却期内不再向该后端发请求，冷却结束后放行一个探测请求
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+WAIT_RECHECK_SECONDS = 1.0
+
+
+class BackendUnavailable(RuntimeError):
+    """某类请求的所有后端均处于熔断状态"""
+
+
+def completions_url(url: str) -> str:
+    """兼容只填写到 /v1 的地址"""
+    url = (url or "").strip().rstrip("/")
+    if url and not url.endswith("/chat/completions"):
+        url += "/chat/completions"
+    return url
+
+
+def _split_keys(value: str) -> List[str]:
+    return [k.strip() for k in (value or "").split(",") if k.strip()]
+
+
+class Backend:
+    """一个大模型服务端点：地址、各类请求使用的模型、Key 池、并发上限及近期表现"""
+
+    def __init__(self, name: str, url: str, keys: List[str], models: Dict[str, str],
+                 max_concurrency: int, priority: int = 0, rpm: int = API_KEY_RPM, tpm: int = API_KEY_TPM,
+                 response_format: str = "none"):
+        self.name = name
+        # 支持的结构化输出：json_schema（约束解码）/ json_object（JSON 模式）/ none
+        self.response_format = response_format.lower()
+        self.url = completions_url(url)
+        self.key_pool = KeyPool(keys, rpm, tpm, name=name)
+        # 值为空字符串表示沿用请求中的模型名；未配置（None）的类别不由该后端处理
+        self.models = {kind: model for kind, model in models.items() if model is not None}
+        self.max_concurrency = max(1, max_concurrency)
+        self.priority = priority
+        self.inflight = 0
+        self.latency: Dict[str, float] = {}
+        self.error_rate = 0.0
+        # 从一半上限起步，由 AIMD 逐步探测；关闭 AIMD 时固定为配置值
+        self.limit = float(max(1, self.max_concurrency // 2)) if LLM_AIMD_ENABLED else float(self.max_concurrency)
+        self.last_decrease = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+
+    def serves(self, kind: str) -> bool:
+        return kind in self.models
+
+    def prepare(self, payload: Dict[str, Any], kind: str) -> Dict[str, Any]:
+        """替换为该后端的模型名，并按后端能力调整或去掉 response_format"""
+        body = {**payload, "model": self.models.get(kind) or payload.get("model")}
+        requested = (body.get("response_format") or {}).get("type")
+        if requested == "json_schema" and self.response_format == "json_object":
+            body["response_format"] = {"type": "json_object"}
+        elif requested and self.response_format not in (requested, "json_schema"):
+            body.pop("response_format")
+        return body
+
+    def state(self, now: Optional[float] = None) -> str:
+        if not self.open_until:
+            return "closed"
+        return "open" if (now or time.monotonic()) < self.open_until else "half_open"
+
+    def has_capacity(self, now: Optional[float] = None) -> bool:
+        state = self.state(now)
+        if state == "open":
+            return False
+        if state == "half_open":
+            return self.inflight == 0
+        return self.inflight < int(self.limit)
+
+    def score(self, kind: str) -> float:
+        """预计等待代价：排队深度 × 近期耗时 × 错误率惩罚，越小越好"""
+        load = (self.inflight + 1) / self.limit
+        return load * self.latency.get(kind, DEFAULT_LATENCY) * (1 + ERROR_PENALTY * self.error_rate)
+
+    def record(self, kind: str, seconds: Optional[float], ok: bool, status: Optional[int] = None):
+        """记录一次请求结果，更新耗时、错误率、并发上限与熔断状态；status 为 None 表示网络异常或超时"""
+        now = time.monotonic()
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (0.0 if ok else 1.0)
+        previous = self.latency.get(kind)
+        if ok:
+            if seconds is not None:
+                self.latency[kind] = seconds if previous is None else (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * seconds
+            if self.open_until:
+                logger.info(f"大模型后端 {self.name} 探测成功，恢复使用")
+            self.failures, self.open_until = 0, 0.0
+            healthy = previous is None or seconds is None or seconds <= HEALTHY_LATENCY_FACTOR * previous
+            if LLM_AIMD_ENABLED and healthy:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            return
+
+        # 400 等请求本身的错误不代表后端过载
+        if status is not None and status != 429 and status < 500:
+            return
+        self.failures += 1
+        if LLM_AIMD_ENABLED and now - self.last_decrease >= AIMD_DECREASE_INTERVAL:
+            self.limit = max(1.0, self.limit * AIMD_DECREASE_FACTOR)
+            self.last_decrease = now
+        state = self.state(now)
+        if state == "half_open" or (state == "closed" and self.failures >= LLM_BREAKER_FAILURES):
+            self.open_until = now + LLM_BREAKER_COOLDOWN
+            metrics.incr("llm.breaker.opened")
+            logger.warning(f"大模型后端 {self.name} 连续失败 {self.failures} 次，熔断 {LLM_BREAKER_COOLDOWN:.0f}s")
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            "priority": self.priority,
+            "inflight": self.inflight,
+            "max_concurrency": self.max_concurrency,
+            "limit": round(self.limit, 2),
+            "state": self.state(),
+            "latency": {kind: round(value, 3) for kind, value in self.latency.items()},
+            "error_rate": round(self.error_rate, 4),
+        }
+
+
+class Router:
+    """
+    按请求类别（text / vision / small_text）把调用分配到不同后端池。
+    优先级数值小的后端（如本地 GPU 服务）有空闲并发时优先使用，满载时才溢出到下一优先级（如托管 API）；
+    同一优先级内按排队深度、近期耗时与错误率选择；所有后端满载时等待任一后端释放，
+    全部熔断时立即抛出 BackendUnavailable。
+    """
+
+    def __init__(self, backends: List[Backend]):
+        self.backends = backends
+        self._waiters: List[asyncio.Future] = []
+
+    def serves(self, kind: str) -> bool:
+        return any(b.serves(kind) for b in self.backends)
+
+    def _choose(self, kind: str, exclude: Optional[Set[str]]) -> Optional[Backend]:
+        now = time.monotonic()
+        pool = [b for b in self.backends if b.serves(kind)]
+        if all(b.state(now) == "open" for b in pool):
+            raise BackendUnavailable(f"所有可处理 {kind} 请求的后端均已熔断")
+        preferred = [b for b in pool if not exclude or b.name not in exclude] or pool
+        for priority in sorted({b.priority for b in preferred}):
+            tier = [b for b in preferred if b.priority == priority and b.has_capacity(now)]
+            if tier:
+                return min(tier, key=lambda b: b.score(kind))
+        return None
+
+    async def acquire(self, kind: str, exclude: Optional[Set[str]] = None) -> Backend:
+        """选出一个后端并占用一个并发名额；exclude 中的后端仅在没有其他后端时才会被选中"""
+        if not self.serves(kind):
+            raise RuntimeError(f"没有可处理 {kind} 请求的后端")
+        while True:
+            backend = self._choose(kind, exclude)
+            if backend is not None:
+                backend.inflight += 1
+                return backend
+            # 熔断冷却结束不会触发释放通知，因此定期重新检查
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await asyncio.wait({waiter}, timeout=WAIT_RECHECK_SECONDS)
+
+    def release(self, backend: Backend, kind: str, seconds: Optional[float], ok: Optional[bool],
+                status: Optional[int] = None):
+        """归还并发名额并记录结果；ok 为 None 表示请求被取消，不计入统计"""
+        if ok is not None:
+            backend.record(kind, seconds, ok, status)
+        backend.inflight = max(0, backend.inflight - 1)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        return {b.name: b.snapshot() for b in self.backends}
+
+    def model_fingerprint(self) -> str:
+        """各后端各类请求使用的模型名，模型配置变化时结果缓存随之失效"""
+        return ";".join(f"{b.name}:" + ",".join(f"{kind}={model}" for kind, model in sorted(b.models.items()))
+                        for b in self.backends)
+
+
+def _load_backends() -> List[Backend]:
+    default_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    if not LLM_BACKENDS:
+        keys = _split_keys(os.getenv("API_KEYS", os.getenv("API_KEY", "")))
+        models = {"text": os.getenv("TEXT_MODEL") or "", "vision": os.getenv("VISION_MODEL") or "",
+                  "small_text": os.getenv("SMALL_TEXT_MODEL") or None}
+        return [Backend("default", os.getenv("API_BASE_URL"), keys, models, default_concurrency,
+                        response_format=os.getenv("LLM_RESPONSE_FORMAT", "none"))]
+
+    backends = []
+    for name in LLM_BACKENDS:
+        prefix = f"LLM_BACKEND_{name.upper()}_"
+        models = {
+            "text": os.getenv(prefix + "TEXT_MODEL"),
+            "vision": os.getenv(prefix + "VISION_MODEL"),
+            "small_text": os.getenv(prefix + "SMALL_TEXT_MODEL"),
+        }
+        backend = Backend(
+            name,
+            os.getenv(prefix + "URL", ""),
+            _split_keys(os.getenv(prefix + "KEYS", "")),
+            models,
+            int(os.getenv(prefix + "MAX_CONCURRENCY", str(default_concurrency))),
+            int(os.getenv(prefix + "PRIORITY", "0")),
+            int(os.getenv(prefix + "RPM", str(API_KEY_RPM))),
+            int(os.getenv(prefix + "TPM", str(API_KEY_TPM))),
+            os.getenv(prefix + "RESPONSE_FORMAT", "none"),
+        )
+        logger.info(f"大模型后端 {name}: {backend.url}，模型 {backend.models}，"
+                    f"并发 {backend.max_concurrency}，优先级 {backend.priority}")
+        backends.append(backend)
+    return backends
+
+
+router = Router(_load_backends())
@@ -1,14 +1,15 @@
-import aiohttp
+from logging_config import logger
+from llm.client import get_session, request_timeout
 
-# 异步发送 POST 请求
-async def send_async_request(url, headers, data):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=data) as response:
-            if response.status == 200:
-                result = await response.json()
-                return result
-            else:
-                print(f"请求失败，状态码: {response.status}")
-                print(await response.text())
-                return None
 
+# 异步发送 POST 请求（复用共享的大模型会话与连接池）
+async def send_async_request(url, headers, data, timeout=400):
+    session = get_session()
+    async with session.post(url, headers=headers, json=data, timeout=request_timeout(timeout)) as response:
+        if response.status == 200:
+            result = await response.json()
+            return result
+        else:
+            logger.error(f"请求失败，状态码: {response.status}")
+            logger.error(await response.text())
+            return None
@@ -0,0 +1,32 @@
+# metrics.py
+import threading
+from typing import Dict, Tuple
+
+
+class Metrics:
+    """进程内计数器，供 /api/v1/metrics 输出；多 worker 部署时每个进程各自统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._ratios: Dict[str, Tuple[str, str]] = {}
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def register_ratio(self, name: str, numerator: str, denominator: str):
+        """登记一个派生比率，如命中率 = 命中次数 / 总次数"""
+        self._ratios[name] = (numerator, denominator)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            counters = dict(self._counters)
+        ratios = {}
+        for name, (numerator, denominator) in self._ratios.items():
+            total = counters.get(denominator, 0)
+            ratios[name] = round(counters.get(numerator, 0) / total, 4) if total else 0.0
+        return {"counters": counters, "ratios": ratios}
+
+
+metrics = Metrics()
@@ -0,0 +1,96 @@
+# result_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from logging_config import logger
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join(tempfile.gettempdir(), "shencha_result_cache.sqlite3"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """分块计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """以文件哈希 + 模型 + 提示词版本为键的提取结果缓存，超出容量时按最近访问时间淘汰"""
+
+    def __init__(self, db_path: str = RESULT_CACHE_PATH, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "cache_key TEXT PRIMARY KEY, file_hash TEXT, filename TEXT, result TEXT, info TEXT, "
+                "size INTEGER, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_file_hash ON results (file_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def make_key(file_hash: str, *versions: str) -> str:
+        return hashlib.sha256("|".join((file_hash,) + tuple(v or "" for v in versions)).encode("utf-8")).hexdigest()
+
+    def get(self, cache_key: str) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """命中时返回 (缓存时的文件名, 结果文本, 结构化数据)"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT filename, result, info FROM results WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+        filename, result, info = row
+        return filename, result, json.loads(info)
+
+    def put(self, cache_key: str, file_hash: str, filename: str, result: str, info: Dict[str, Any]):
+        info_json = json.dumps(info, ensure_ascii=False)
+        size = len(result.encode("utf-8")) + len(info_json.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, file_hash, filename, result, info_json, size, time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for cache_key, size in conn.execute("SELECT cache_key, size FROM results ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM results WHERE cache_key = ?", (cache_key,))
+            total -= size
+            evicted += 1
+        logger.info(f"结果缓存超出容量，淘汰 {evicted} 条")
+
+    def invalidate(self, file_hash: str) -> int:
+        """删除某个文件的全部缓存结果，返回删除条数"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM results WHERE file_hash = ?", (file_hash,)).rowcount
+
+    def clear(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM results").rowcount
+
+
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
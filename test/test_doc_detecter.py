@@ -0,0 +1,27 @@
+from agent.doc_detecter import label_answered, label_ready
+
+
+def test_bare_label_stops_stream():
+    assert label_ready("专利")
+    assert label_ready(" 【论文】。\n")
+    assert not label_ready("专")
+
+
+def test_label_after_think_stops_stream():
+    assert not label_ready("<think>判断这是专利还是论文")
+    assert label_ready("<think>判断这是专利还是论文</think>\n论文")
+    assert not label_ready("<think>这是专利</think>\n")
+
+
+def test_reasoning_without_opening_tag_does_not_stop_on_label_words():
+    assert not label_ready("判断这是专利还是论文")
+    assert not label_ready("判断这是专利还是论文，文中有 DOI")
+    assert label_ready("判断这是专利还是论文，文中有 DOI</think>论文")
+
+
+def test_label_answered():
+    assert label_answered("专利")
+    assert label_answered("该文档是专利")
+    assert label_answered("判断一下</think>标准")
+    assert not label_answered("<think>这是专利还是论文")
+    assert not label_answered("<think>这是专利</think>")
@@ -0,0 +1,46 @@
+from agent.field_extractor import extract_fields
+
+
+def test_patent_number_after_cjk_without_colon():
+    assert extract_fields("专利号ZL 2019 1 0012345.6", "专利")["专利号"] == "ZL201910012345.6"
+
+
+def test_patent_number_with_colon():
+    assert extract_fields("专利号：201910012345.6", "专利")["专利号"] == "201910012345.6"
+
+
+def test_patent_number_inside_identifier_is_ignored():
+    assert "专利号" not in extract_fields("编码XZL201910012345.6", "专利")
+
+
+def test_patent_dates():
+    found = extract_fields("申请日：2019年1月5日\n授权公告日：2020.02.03", "专利")
+    assert found["申请日期"] == "2019-01-05"
+    assert found["授权日期"] == "2020-02-03"
+
+
+def test_doi_after_cjk():
+    assert extract_fields("本文DOI:10.1000/abc123", "论文")["DOI"] == "10.1000/abc123"
+
+
+def test_doi_url():
+    assert extract_fields("doi: https://doi.org/10.1002/ajh.27000.", "论文")["DOI"] == "10.1002/ajh.27000"
+
+
+def test_standard_number_after_cjk():
+    found = extract_fields("国家标准GB/T 7714—2015", "标准")
+    assert found["标准编号"] == "GB/T 7714-2015"
+
+
+def test_doi_org_url_without_doi_label():
+    found = extract_fields("Received: 4 December 2023\nhttps://doi.org/10.1002/ajh.27000", "论文")
+    assert found["DOI"] == "10.1002/ajh.27000"
+    assert extract_fields("见 dx.doi.org/10.1000/xyz.", "论文")["DOI"] == "10.1000/xyz"
+
+
+def test_group_standard_number():
+    assert extract_fields("团体标准 T/CECS 123—2020", "标准")["标准编号"] == "T/CECS 123-2020"
+
+
+def test_software_registration_number():
+    assert extract_fields("登记号：2020SR1234567", "软著")["登记号"] == "2020SR1234567"
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from llm import governor as governor_module
+from llm.governor import LLMGovernor
+
+
+def _enter(gov, kind):
+    async def run():
+        async with gov.slot(kind):
+            return True
+    return asyncio.run(asyncio.wait_for(run(), timeout=2))
+
+
+def test_zero_limit_means_unlimited(tmp_path):
+    gov = LLMGovernor(str(tmp_path), {"text": 0, "vision": 0})
+    assert _enter(gov, "text")
+    assert _enter(gov, "vision")
+    assert not list(tmp_path.glob("*.lock"))
+
+
+def test_zero_limit_without_fcntl(tmp_path, monkeypatch):
+    monkeypatch.setattr(governor_module, "fcntl", None)
+    gov = LLMGovernor(str(tmp_path), {"text": 0, "vision": 2})
+    assert _enter(gov, "text")
+    assert _enter(gov, "vision")
+
+
+@pytest.mark.skipif(governor_module.fcntl is None, reason="需要 fcntl")
+def test_zero_limit_still_checks_rpm(tmp_path):
+    gov = LLMGovernor(str(tmp_path), {"text": 0, "vision": 0}, rpm=1)
+    assert _enter(gov, "text")
+    assert (tmp_path / "rpm.log").read_text().strip()
+    with pytest.raises(asyncio.TimeoutError):
+        _enter(gov, "text")
+
+
+@pytest.mark.skipif(governor_module.fcntl is None, reason="需要 fcntl")
+def test_slots_are_limited(tmp_path):
+    gov = LLMGovernor(str(tmp_path), {"text": 1, "vision": 1})
+
+    async def run():
+        async with gov.slot("text"):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(gov.slot("text").__aenter__(), timeout=0.3)
+        async with gov.slot("text"):
+            return True
+    assert asyncio.run(run())
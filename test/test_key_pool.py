@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from llm import key_pool as key_pool_module
+from llm.key_pool import KeyPool
+
+# 同一目录下的两个 KeyPool 模拟两个 uvicorn worker
+needs_fcntl = pytest.mark.skipif(key_pool_module.fcntl is None, reason="需要 fcntl")
+
+
+def _acquire(pool, timeout=0.3, **kwargs):
+    return asyncio.run(asyncio.wait_for(pool.acquire(**kwargs), timeout=timeout))
+
+
+@needs_fcntl
+def test_rpm_budget_is_shared_across_processes(tmp_path):
+    first = KeyPool(["k1"], rpm=2, directory=str(tmp_path))
+    second = KeyPool(["k1"], rpm=2, directory=str(tmp_path))
+    assert _acquire(first) == "k1"
+    assert _acquire(second) == "k1"
+    with pytest.raises(asyncio.TimeoutError):
+        _acquire(first)
+    with pytest.raises(asyncio.TimeoutError):
+        _acquire(second)
+
+
+@needs_fcntl
+def test_rate_limited_key_is_benched_for_other_processes(tmp_path):
+    first = KeyPool(["k1", "k2"], directory=str(tmp_path))
+    second = KeyPool(["k1", "k2"], directory=str(tmp_path))
+    key = _acquire(first)
+    first.report(key, 429, retry_after=30)
+    for _ in range(3):
+        other = _acquire(second)
+        assert other != key
+        second.report(other, 200)
+
+
+@needs_fcntl
+def test_pools_with_different_names_do_not_share(tmp_path):
+    first = KeyPool(["k1"], rpm=1, name="a", directory=str(tmp_path))
+    second = KeyPool(["k1"], rpm=1, name="b", directory=str(tmp_path))
+    assert _acquire(first) == "k1"
+    assert _acquire(second) == "k1"
+
+
+@needs_fcntl
+def test_state_file_does_not_store_keys(tmp_path):
+    pool = KeyPool(["sk-secret"], rpm=5, directory=str(tmp_path))
+    _acquire(pool)
+    assert "sk-secret" not in (tmp_path / "keys_default.json").read_text()
+
+
+def test_without_fcntl_state_stays_in_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(key_pool_module, "fcntl", None)
+    first = KeyPool(["k1"], rpm=1, directory=str(tmp_path))
+    second = KeyPool(["k1"], rpm=1, directory=str(tmp_path))
+    assert _acquire(first) == "k1"
+    assert _acquire(second) == "k1"
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,45 @@
+import pytest
+
+from agent.pdf_reader import (
+    OCR_MAX_LONG_EDGE, OCR_MIN_DPI, PDF_POINTS_PER_INCH, page_text_quality, render_zoom,
+)
+
+
+def test_clean_text_has_no_garbled_chars():
+    chars, ratio = page_text_quality("专利号 ZL201910012345.6\n授权公告日 2020-01-02")
+    assert chars == len("专利号ZL201910012345.6授权公告日2020-01-02")
+    assert ratio == 0.0
+
+
+def test_each_cid_glyph_counts_once():
+    chars, ratio = page_text_quality("字" * 100 + "(cid:123)" * 10)
+    assert chars == 100
+    assert ratio == pytest.approx(10 / 110)
+
+
+def test_cid_only_page_is_fully_garbled():
+    chars, ratio = page_text_quality("(cid:12)(cid:345) (cid:6)")
+    assert chars == 0
+    assert ratio == 1.0
+
+
+def test_replacement_and_private_use_chars_are_garbled():
+    chars, ratio = page_text_quality("ab\ufffd\ue000")
+    assert chars == 2
+    assert ratio == 0.5
+
+
+def test_empty_page():
+    assert page_text_quality(" \n ") == (0, 0.0)
+
+
+def test_render_zoom_never_exceeds_old_2x():
+    assert render_zoom(298, 420) == pytest.approx(2.0)
+    assert 1.9 < render_zoom(595, 842) <= 2.0
+    assert render_zoom(842, 1191) < 2.0
+
+
+def test_render_zoom_respects_long_edge_on_large_sheets():
+    zoom = render_zoom(2384, 3370)
+    assert 3370 * zoom <= OCR_MAX_LONG_EDGE + 1e-6
+    assert zoom * PDF_POINTS_PER_INCH < OCR_MIN_DPI
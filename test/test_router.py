@@ -0,0 +1,20 @@
+from llm.router import Backend, Router
+
+
+def _router(text_model, vision_model="vm"):
+    return Router([
+        Backend("local", "http://127.0.0.1:8000/v1", ["k"], {"text": text_model, "vision": None}, 4, priority=0),
+        Backend("cloud", "http://127.0.0.1:9000/v1", ["k"], {"text": "", "vision": vision_model}, 4, priority=1),
+    ])
+
+
+def test_model_fingerprint_changes_with_backend_models():
+    assert _router("qwen-7b").model_fingerprint() == _router("qwen-7b").model_fingerprint()
+    assert _router("qwen-7b").model_fingerprint() != _router("qwen-14b").model_fingerprint()
+    assert _router("qwen-7b").model_fingerprint() != _router("qwen-7b", "vl-72b").model_fingerprint()
+
+
+def test_model_fingerprint_lists_every_backend():
+    fingerprint = _router("qwen-7b").model_fingerprint()
+    assert "local:text=qwen-7b" in fingerprint
+    assert "cloud:text=,vision=vm" in fingerprint
@@ -0,0 +1,41 @@
+import pytest
+
+from agent.rule_classifier import classify_by_rules, score_text
+
+
+@pytest.mark.parametrize("text", [
+    "DB11/T 1234-2020 地方标准 起草单位",
+    "JB/T 5000.1-2007 行业标准 起草单位",
+    "T/CECS 123-2020 团体标准 起草单位",
+    "国家标准GB/T 7714-2015",
+])
+def test_standard_numbers(text):
+    doc_type, confidence = classify_by_rules(text)
+    assert doc_type == "标准"
+    assert confidence > 0
+
+
+def test_patent_number_after_cjk():
+    assert score_text("专利号ZL201910012345.6")["专利"] >= 6.0
+    assert classify_by_rules("专利号ZL201910012345.6 专利证书")[0] == "专利"
+
+
+def test_doi_after_cjk():
+    assert score_text("本文DOI:10.1000/abc123")["论文"] >= 6.0
+
+
+def test_software_registration_after_cjk():
+    assert score_text("登记号2020SR1234567")["软著"] >= 5.0
+
+
+def test_number_inside_identifier_is_ignored():
+    assert score_text("XZL201910012345.6")["专利"] == 0.0
+
+
+def test_insufficient_evidence():
+    assert classify_by_rules("") == ("其他", 0.0)
+    assert classify_by_rules("一些普通的文字") == ("其他", 0.0)
+
+
+def test_doi_org_url():
+    assert score_text("https://doi.org/10.1002/ajh.27000")["论文"] >= 6.0
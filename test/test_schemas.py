@@ -0,0 +1,68 @@
+from agent.schemas import validate_fields
+
+PATENT_FIELDS = ["专利号", "申请日期", "授权日期", "发明人"]
+
+
+def test_valid_fields_are_normalized():
+    valid, invalid = validate_fields("专利", {
+        "专利号": " ZL201910012345.6 ",
+        "申请日期": "2019年1月5日",
+        "授权日期": "2020-02-03",
+        "发明人": ["张三", "李四"],
+    }, PATENT_FIELDS)
+    assert invalid == {}
+    assert valid == {
+        "专利号": "ZL201910012345.6",
+        "申请日期": "2019-01-05",
+        "授权日期": "2020-02-03",
+        "发明人": "张三; 李四",
+    }
+
+
+def test_missing_spellings_become_na():
+    valid, invalid = validate_fields("专利", {
+        "专利号": "NULL",
+        "申请日期": "无",
+        "授权日期": "none",
+        "发明人": "",
+    }, PATENT_FIELDS)
+    assert invalid == {}
+    assert valid == {field: "N/A" for field in PATENT_FIELDS}
+
+
+def test_invalid_fields_are_reported_separately():
+    valid, invalid = validate_fields("专利", {"专利号": "ZL1", "申请日期": "未知"}, ["专利号", "申请日期"])
+    assert valid == {"专利号": "ZL1"}
+    assert list(invalid) == ["申请日期"]
+    assert invalid["申请日期"][0] == "未知"
+
+
+def test_fields_outside_request_are_ignored():
+    valid, invalid = validate_fields("专利", {"专利号": "ZL1", "申请日期": "未知"}, ["专利号"])
+    assert valid == {"专利号": "ZL1"}
+    assert invalid == {}
+
+
+def test_paper_year_and_doi():
+    fields = ["year", "DOI"]
+    valid, invalid = validate_fields("论文", {"year": "2024", "DOI": "https://doi.org/10.1000/abc123"}, fields)
+    assert invalid == {}
+    assert valid == {"year": 2024, "DOI": "10.1000/abc123"}
+
+    valid, invalid = validate_fields("论文", {"year": 1800, "DOI": "abc"}, fields)
+    assert valid == {}
+    assert set(invalid) == {"year", "DOI"}
+
+
+def test_standard_form_literal():
+    valid, invalid = validate_fields("标准", {"标准形式": "国标"}, ["标准形式"])
+    assert valid == {"标准形式": "国标"}
+    _, invalid = validate_fields("标准", {"标准形式": "企标"}, ["标准形式"])
+    assert list(invalid) == ["标准形式"]
+
+
+def test_unparsed_reply_marks_every_field_invalid():
+    for data in ({"error": "解析失败"}, "not json", None):
+        valid, invalid = validate_fields("软著", data, ["证书号", "授权时间"])
+        assert valid == {}
+        assert set(invalid) == {"证书号", "授权时间"}